@@ -1,13 +1,23 @@
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery
-from aiogram.filters import Command, StateFilter, Filter
+from aiogram.types import Message, CallbackQuery, FSInputFile
+from aiogram.filters import Command, CommandObject, StateFilter, Filter
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 
-from collections import defaultdict
-
-from app.database.requests import deduct_all_expenses, add_money_to_company, get_users, update_monthly_expenses, get_user_with_business, increase_prices_by_15_percent, get_business_by_id
+from app.database.requests import deduct_all_expenses, add_money_to_company, remove_money_from_company, InsufficientFundsError, update_monthly_expenses, adjust_prices, get_business_contact, create_broadcast, create_broadcast_to_all, enqueue_message
 from app.keyboards import admin_keyboard
+from app.database.catalog import catalog
+from app.database.reports import get_business_report
+from app.report import MESSAGE_LIMIT, send_report, render_report_async, report_snapshots, report_page_keyboard
+from app.database.events import event_sink
+from app.database.identity import identity_cache
+from app.database.writer import write_queue
+from app.broadcast import broadcaster
+from app.outbox import dispatcher
+from app.idempotency import idempotency
+from app.export import Workbook, export_csv, export_xlsx
+
+import tempfile
 
 
 
@@ -32,6 +42,9 @@ class UpdateExpenses(StatesGroup):
     awaiting_business_id = State()
     awaiting_new_expenses = State()
 
+class Inflation(StatesGroup):
+    awaiting_params = State()  # Процент и область изменения цен
+
 
 class Admin(Filter):
     """Фильтр для проверки, является ли пользователь администратором."""
@@ -49,28 +62,92 @@ async def admin_start(message: Message):
     )
 
 
+@admin.message(Admin(), Command("stats"))
+async def show_stats(message: Message, state: FSMContext):
+    """Показывает счетчики кэшей и очередей бота."""
+    catalog_stats = catalog.stats()
+    sink_stats = event_sink.stats()
+    idempotency_stats = idempotency.stats()
+    identity_stats = identity_cache.stats()
+    writer_stats = write_queue.stats()
+    broadcast_stats = broadcaster.stats()
+    outbox_stats = dispatcher.stats()
+    fsm_stats = state.storage.stats() if hasattr(state.storage, 'stats') else None
+    await message.answer(
+        "📈 Кэш каталога:\n"
+        f"Загружен: {'да' if catalog_stats['loaded'] else 'нет'}, товаров: {catalog_stats['items']}\n"
+        f"Попадания: {catalog_stats['hits']}, промахи: {catalog_stats['misses']}, "
+        f"сбросы: {catalog_stats['invalidations']}\n\n"
+        "📝 Очередь журнала событий:\n"
+        f"В очереди: {sink_stats['depth']} из {sink_stats['max_queue']}, "
+        f"записано: {sink_stats['written']} ({sink_stats['batches']} пачек), "
+        f"ошибок: {sink_stats['failed']}, ожиданий: {sink_stats['blocked']}, откачено: {sink_stats['discarded']}\n\n"
+        "🔁 Повторные нажатия:\n"
+        f"В кэше: {idempotency_stats['cached']}, выполняется: {idempotency_stats['in_flight']}, "
+        f"отклонено дублей: {idempotency_stats['duplicates']}\n\n"
+        "👤 Кэш пользователей:\n"
+        f"Записей: {identity_stats['size']}, попадания: {identity_stats['hits']}, "
+        f"промахи: {identity_stats['misses']}, вытеснено: {identity_stats['evictions']}, устарели: {identity_stats['expired']}\n\n"
+        "✍️ Очередь записи:\n"
+        f"Включена: {'да' if writer_stats['running'] else 'нет'}, в очереди: {writer_stats['depth']}, "
+        f"выполнено: {writer_stats['committed']} ({writer_stats['batches']} транзакций), "
+        f"ошибок: {writer_stats['failed']}\n\n"
+        "📨 Рассылки:\n"
+        f"Лимит: {broadcast_stats['rate']} сообщ./с, отправлено: {broadcast_stats['sent']}, "
+        f"ошибок: {broadcast_stats['failed']}, повторов: {broadcast_stats['retries']}\n\n"
+        "📤 Outbox:\n"
+        f"Отправлено: {outbox_stats['sent']}, ошибок: {outbox_stats['failed']}, повторов: {outbox_stats['retries']}\n"
+        f"Сводки в канал: {outbox_stats['digests']} (постов в них: {outbox_stats['coalesced']}), "
+        f"окно, с: {outbox_stats['digest_window'] or 'выкл.'}"
+        + _format_fsm_stats(fsm_stats)
+    )
+
+
+def _format_fsm_stats(stats):
+    if stats is None:
+        return ""
+    if stats['storage'] == 'db':
+        return ("\n\n🧭 Состояния FSM (база):\n"
+                f"В кэше: {stats['size']}, попадания: {stats['hits']}, промахи: {stats['misses']}, "
+                f"устарели: {stats['stale']}, "
+                f"удалено по TTL: {stats['purged']}")
+    return ("\n\n🧭 Состояния FSM (память):\n"
+            f"Живых: {stats['live']} из {stats['max_entries']}, удалено по TTL: {stats['expired']}, "
+            f"вытеснено: {stats['evicted']}, ждут уведомления: {stats['tombstones']}")
+
+
 @admin.callback_query(Admin(), F.data == "deduct_expenses")
 async def deduct_expenses(callback: CallbackQuery):
     """Списывает ежемесячные затраты у всех пользователей и уведомляет их."""
-    total_deducted = await deduct_all_expenses()
-    users = await get_users()
-
-    for user in users:
-        if user.business:  # Проверяем, что у пользователя есть бизнес
-            try:
-                # Отправляем персонализированное сообщение
-                await callback.bot.send_message(
-                    chat_id=user.tg_id,
-                    text=f"С вашей компании '{user.business.name}' списаны ежемесячные затраты в размере {user.business.expenses} рублей."
-                )
-            except Exception as e:
-                print(f"Не удалось отправить сообщение пользователю {user.tg_id}: {e}")
+    total_deducted, charges = await deduct_all_expenses()
+
+    recipients = []
+    for charge in charges:
+        if charge.paid:
+            text = f"С вашей компании '{charge.business_name}' списаны ежемесячные затраты в размере {charge.expenses} рублей."
+        else:
+            text = (f"У вашей компании '{charge.business_name}' недостаточно средств для списания ежемесячных затрат. "
+                    f"Требуется: {charge.expenses}, доступно: {charge.budget}.")
+        recipients.append((charge.tg_id, text))
+
+    # Уведомления отправит рассылка; она пишется в одной транзакции со списанием
+    await create_broadcast("Списание ежемесячных затрат", recipients, admin_chat_id=callback.message.chat.id)
 
     await callback.message.answer(f"Списаны ежемесячные затраты на общую сумму {total_deducted} рублей.")
         
 
 
 
+@admin.message(Admin(), Command("broadcast"))
+async def broadcast(message: Message, command: CommandObject):
+    """Рассылает текст всем игрокам: /broadcast <текст>."""
+    if not command.args:
+        await message.answer("Использование: /broadcast <текст сообщения>")
+        return
+    broadcast_id = await create_broadcast_to_all("Сообщение всем игрокам", command.args, admin_chat_id=message.chat.id)
+    await message.answer(f"Рассылка №{broadcast_id} поставлена в очередь.")
+
+
 @admin.callback_query(Admin(), F.data == "add_money")
 async def add_money_start(callback: CallbackQuery, state: FSMContext):
     """Начинает процесс добавления денег компании."""
@@ -100,35 +177,29 @@ async def process_add_money(message: Message, state: FSMContext):
     """Обрабатывает ввод суммы для пополнения и уведомляет владельца компании."""
     data = await state.get_data()
     business_id = data.get("business_id")
-    business = await get_business_by_id(business_id)
 
     try:
         amount = int(message.text)
         if amount <= 0:
             raise ValueError
+    except ValueError:
+        await message.answer("Введите корректную сумму (целое число больше 0).")
+        return
 
-        # Добавляем деньги на счет компании
-        await add_money_to_company(business_id, amount)
-        
-
-        if business and business.users:  # Проверяем, есть ли пользователи у бизнеса
-            owner = business.users[0]  # Берем первого владельца
-
-            try:
-                # Отправляем уведомление владельцу компании
-                await message.bot.send_message(
-                    chat_id=owner.tg_id,
-                    text=f"💰 На счет вашей компании '{business.name}' поступило {amount} рублей."
-                )
-            except Exception as e:
-                print(f"⚠️ Не удалось отправить сообщение пользователю {owner.tg_id}: {e}")
-        else:
-            await message.answer(f"⚠️ Внимание: У компании с ID {business_id} нет зарегистрированных владельцев.")
-        await message.answer(f"Компании {business.name} получила {amount} рублей")
+    # Добавляем деньги на счет компании одним UPDATE
+    if not await add_money_to_company(business_id, amount):
+        await message.answer(f"Компания с ID {business_id} не найдена.")
         await state.clear()
+        return
 
-    except ValueError:
-        await message.answer("Введите корректную сумму (целое число больше 0).")
+    business = await get_business_contact(business_id)
+    if business.owner_tg_id:  # Проверяем, есть ли пользователи у бизнеса
+        # Уведомление владельцу уйдет через outbox после commit
+        await enqueue_message(business.owner_tg_id, f"💰 На счет вашей компании '{business.name}' поступило {amount} рублей.")
+    else:
+        await message.answer(f"⚠️ Внимание: У компании с ID {business_id} нет зарегистрированных владельцев.")
+    await message.answer(f"Компании {business.name} получила {amount} рублей")
+    await state.clear()
 
 
 
@@ -160,34 +231,35 @@ async def process_remove_money(message: Message, state: FSMContext):
     """Обрабатывает ввод суммы для снятия и уведомляет владельца компании."""
     data = await state.get_data()
     business_id = data.get("business_id")
-    business = await get_business_by_id(business_id)
 
     try:
         amount = int(message.text)
         if amount <= 0:
             raise ValueError
+    except ValueError:
+        await message.answer("Введите корректную сумму (целое число больше 0).")
+        return
 
-        # Снимаем деньги со счета компании
+    # Снимаем деньги со счета компании: проверка бюджета и списание в одном UPDATE
+    try:
         await remove_money_from_company(business_id, amount)
-
-        if business and business.users:  # Проверяем, есть ли пользователи у бизнеса
-            owner = business.users[0]  # Берем первого владельца
-
-            try:
-                # Отправляем уведомление владельцу компании
-                await message.bot.send_message(
-                    chat_id=owner.tg_id,
-                    text=f"💰 Со счета вашей компании '{business.name}' было снято {amount} рублей."
-                )
-            except Exception as e:
-                print(f"⚠️ Не удалось отправить сообщение пользователю {owner.tg_id}: {e}")
-        else:
-            await message.answer(f"⚠️ Внимание: У компании с ID {business_id} нет зарегистрированных владельцев.")
-        await message.answer(f"С компании {business.name} было снято {amount} рублей")
+    except InsufficientFundsError as e:
+        await message.answer(f"❌ {e}")
         await state.clear()
-
+        return
     except ValueError:
-        await message.answer("Введите корректную сумму (целое число больше 0).")
+        await message.answer(f"Компания с ID {business_id} не найдена.")
+        await state.clear()
+        return
+
+    business = await get_business_contact(business_id)
+    if business.owner_tg_id:  # Проверяем, есть ли пользователи у бизнеса
+        # Уведомление владельцу уйдет через outbox после commit
+        await enqueue_message(business.owner_tg_id, f"💰 Со счета вашей компании '{business.name}' было снято {amount} рублей.")
+    else:
+        await message.answer(f"⚠️ Внимание: У компании с ID {business_id} нет зарегистрированных владельцев.")
+    await message.answer(f"С компании {business.name} было снято {amount} рублей")
+    await state.clear()
 
 
 @admin.callback_query(Admin(), F.data == "update_expenses")
@@ -232,69 +304,98 @@ async def process_new_expenses(message: Message, state: FSMContext):
 async def create_report(callback: CallbackQuery):
     """Делает отчет по текущему балансу всех компаний"""
 
-    users = await get_users()
+    report_data = await get_business_report()
 
-    if not users:
-        await callback.message.answer("В базе данных нет зарегистрированных пользователей.")
+    if not report_data.companies:
+        await callback.message.answer("В базе данных нет компаний.")
         return
 
-    companies = []
-    business_summary = defaultdict(list)
+    # Отчет уходит несколькими сообщениями в пределах лимита Telegram
+    await send_report(callback.message, report_data)
 
-    # Собираем данные о компаниях и группируем по типу бизнеса
-    for user in users:
-        if user.business:  
-            name = user.business.name
-            business_type = user.business.type
-            budget = user.business.budget
-            income = user.business.income
-            cost = user.business.cost
-            profit = income - cost  # Разница между доходом и расходом
 
-            companies.append((name, business_type, budget, income, cost, profit))
-            business_summary[business_type].append((name, budget, income, cost, profit))  # Добавляем КОРТЕЖИ
+@admin.callback_query(Admin(), F.data == "report_pages")
+async def report_pages(callback: CallbackQuery):
+    """Показывает снимок отчета постранично с кнопками листания."""
+    report_data = await get_business_report()
 
-    # Сортируем компании по прибыли (от большего к меньшему)
-    companies.sort(key=lambda x: x[4], reverse=True)
+    if not report_data.companies:
+        await callback.message.answer("В базе данных нет компаний.")
+        return
 
-    # Формируем первую часть отчета: компании по прибыли
-    report = "🏢 Все компании по прибыли (от большего к меньшему):\n\n"
-    for idx, (name, business_type, budget, income, cost, profit) in enumerate(companies, 1):
-        report += f"{idx}. {name} ({business_type}) — 💰 Бюджет: {budget} ₽,\n 💵 Доход: {income} ₽, 📉 Расход: {cost} ₽, 📊 Прибыль: {profit} ₽\n"
+    # Страницы короче лимита, чтобы оставалось место под номер страницы
+    pages = await render_report_async(report_data, limit=MESSAGE_LIMIT - 100)
+    snapshot_id = report_snapshots.add(pages)
+    await callback.message.answer(pages[0], reply_markup=report_page_keyboard(snapshot_id, 0, len(pages)))
 
-    # Формируем вторую часть отчета: сравнение типов бизнеса
-    report += "\n📊 Сравнение по категориям бизнеса:\n\n"
-    for business_type, businesses in business_summary.items():
-        total_income = sum(income for _, _, income, _, _ in businesses)
-        total_cost = sum(cost for _, _, _, cost, _ in businesses)
-        total_budget = sum(budget for _, budget, _, _, _ in businesses)        
-        avg_budget = total_budget // len(businesses)
-        total_profit = total_income - total_cost
 
+@admin.callback_query(Admin(), F.data.startswith("report_page_"))
+async def report_page(callback: CallbackQuery):
+    """Листает сохраненный снимок отчета, не пересчитывая его."""
+    data = callback.data.split("_")
+    if data[2] == "noop":
+        await callback.answer()
+        return
+
+    snapshot_id, page = int(data[2]), int(data[3])
+    pages = report_snapshots.get(snapshot_id)
+    if pages is None:
+        await callback.answer("Отчет устарел, сформируйте новый.", show_alert=True)
+        return
+
+    await callback.message.edit_text(pages[page], reply_markup=report_page_keyboard(snapshot_id, page, len(pages)))
+    await callback.answer()
 
-        report += (f"{business_type}\n"
-                   f"🔹 Количество компаний: {len(businesses)}\n"
-                   f"💵 Общий бюджет: {total_budget} ₽\n"
-                   f"💰 Общий доход: {total_income} ₽\n"
-                   f"📉 Общий расход: {total_cost} ₽\n"
-                   f"📊 Общая прибыль: {total_profit} ₽\n"
-                   f"🏢 Компании:\n")
 
-        # Добавляем список компаний в этой категории
-        for name, budget, income, cost, profit in sorted(businesses, key=lambda x: x[4], reverse=True):
-            report += f"   - {name}:  💰 Бюджет: {budget} ₽, 💵 Доход: {income} ₽, 📉 Расход: {cost} ₽, 📊 Прибыль: {profit} ₽\n"  
-        report += "\n"  # Отделяем категории
 
-    await callback.message.answer(report)
+@admin.message(Admin(), Command("export"))
+async def export_data(message: Message, command: CommandObject):
+    """Выгружает компании, корзины и журнал событий файлом: /export [csv|xlsx]."""
+    fmt = (command.args or "csv").strip().lower()
+    if fmt not in ("csv", "xlsx"):
+        await message.answer("Использование: /export csv или /export xlsx")
+        return
+    if fmt == "xlsx" and Workbook is None:
+        await message.answer("Для XLSX нужен пакет openpyxl, выгружаю в CSV.")
+        fmt = "csv"
 
+    await message.answer("⏳ Готовлю выгрузку...")
+    with tempfile.TemporaryDirectory() as directory:
+        paths = await (export_xlsx(directory) if fmt == "xlsx" else export_csv(directory))
+        for path in paths:
+            await message.answer_document(FSInputFile(path))
 
 
 @admin.callback_query(Admin(), F.data == "inflation")
-async def update_expenses_start(callback: CallbackQuery, state: FSMContext):
-    """Обрабатывает команду увеличения цен на 15%."""
+async def inflation_start(callback: CallbackQuery, state: FSMContext):
+    """Начинает процесс изменения цен."""
+    await callback.message.answer(
+        "Введите процент изменения цен и, при необходимости, область:\n"
+        "15 — все товары\n"
+        "15 category 2 — товары категории с ID 2\n"
+        "-10 podcategory 5 — товары подкатегории с ID 5"
+    )
+    await state.set_state(Inflation.awaiting_params)
+
+
+@admin.message(Admin(), StateFilter(Inflation.awaiting_params))
+async def process_inflation(message: Message, state: FSMContext):
+    """Изменяет цены товаров на указанный процент."""
+    parts = message.text.split()
+    scope = {}
+    try:
+        percent = float(parts[0].replace(",", ".").rstrip("%"))
+        if len(parts) == 3 and parts[1] in ("category", "podcategory"):
+            scope[f"{parts[1]}_id"] = int(parts[2])
+        elif len(parts) != 1:
+            raise ValueError
+    except (ValueError, IndexError):
+        await message.answer("Введите процент числом, например: 15, 15 category 2 или 15 podcategory 5.")
+        return
+
     try:
-        # Увеличиваем цены на 15%
-        updated_items_count = await increase_prices_by_15_percent()
-        await callback.message.answer(f"✅ Цены на все продукты успешно увеличены на 15%. Обновлено товаров: {updated_items_count}.")
+        updated_items_count = await adjust_prices(percent, **scope)
+        await message.answer(f"✅ Цены успешно изменены на {percent:g}%. Обновлено товаров: {updated_items_count}.")
     except Exception as e:
-        await callback.message.answer(f"❌ Произошла ошибка при обновлении цен: {e}")
\ No newline at end of file
+        await message.answer(f"❌ Произошла ошибка при обновлении цен: {e}")
+    await state.clear()
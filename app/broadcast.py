@@ -0,0 +1,241 @@
+import asyncio
+import logging
+
+from aiogram.exceptions import (TelegramAPIError, TelegramBadRequest, TelegramNetworkError,
+                                TelegramRetryAfter, TelegramServerError)
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import app.database.requests as rq
+
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Общий лимит сообщений в секунду для всех отправителей.
+
+    Каждый вызов acquire занимает следующий свободный интервал 1/rate.
+    После RetryAfter от Telegram pause останавливает всех отправителей
+    на указанное время.
+    """
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self._next = 0.0
+        self._paused_until = 0.0
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            if loop.time() >= self._paused_until:
+                return
+
+    def pause(self, seconds):
+        loop = asyncio.get_running_loop()
+        self._paused_until = max(self._paused_until, loop.time() + seconds)
+        self._next = max(self._next, self._paused_until)
+
+
+class Broadcaster:
+    """Фоновая отправка рассылок из таблиц broadcasts и broadcast_recipients.
+
+    Получатели читаются страницами и отправляются concurrency параллельными
+    отправителями под общим лимитом rate сообщений в секунду. RetryAfter
+    приостанавливает всю отправку на указанное Telegram время, сетевые ошибки
+    повторяются. Итоги сохраняются после каждой страницы, поэтому после
+    перезапуска рассылка продолжится с первого неотправленного получателя
+    (повторно может прийти не больше одной страницы сообщений). Ход рассылки
+    показывается в одном сообщении администратору, которое редактируется.
+    """
+    PAGE_SIZE = 200
+    MAX_ATTEMPTS = 5
+    PROGRESS_INTERVAL = 3.0  # Секунд между правками сообщения о ходе рассылки
+    POLL_INTERVAL = 30.0  # Проверка новых рассылок, если пробуждение не пришло
+
+    def __init__(self, rate=25, concurrency=10):
+        self.rate = rate
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate)
+        self._bot = None
+        self._task = None
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def start(self, bot):
+        if self.running:
+            return
+        self._bot = bot
+        self._stopping = False
+        self._task = asyncio.create_task(self._run(), name='broadcaster')
+
+    async def stop(self):
+        """Дожидается отправки текущих сообщений и сохраняет итоги."""
+        if not self.running:
+            return
+        self._stopping = True
+        self._wake.set()
+        await self._task
+        self._task = None
+
+    def wake(self):
+        self._wake.set()
+
+    async def _run(self):
+        while not self._stopping:
+            self._wake.clear()
+            try:
+                for job in await rq.get_unfinished_broadcasts():
+                    await self._deliver(job)
+                    if self._stopping:
+                        return
+            except Exception:
+                logger.exception('Ошибка рассылки')
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, job):
+        await rq.update_broadcast(job.id, status="running")
+        counts = await rq.get_broadcast_counts(job.id)
+        progress = Progress(job, sum(counts.values()), counts.get("sent", 0), counts.get("failed", 0))
+        if job.admin_chat_id and not job.status_message_id:
+            message = await self._safe(self._bot.send_message(job.admin_chat_id, progress.text()))
+            if message:
+                progress.message_id = message.message_id
+                await rq.update_broadcast(job.id, status_message_id=message.message_id)
+
+        after_id = 0
+        while not self._stopping:
+            targets = await rq.get_broadcast_targets(job.id, after_id, self.PAGE_SIZE)
+            if not targets:
+                break
+            after_id = targets[-1].id
+            results = await self._send_page(job, targets)
+            await rq.mark_broadcast_targets(results)
+            progress.add(results)
+            await self._report(progress)
+
+        if not self._stopping:
+            await rq.update_broadcast(job.id, status="done")
+            await self._report(progress, final=True)
+
+    async def _send_page(self, job, targets):
+        results = []
+        pending = iter(targets)
+
+        async def sender():
+            for target in pending:
+                if self._stopping:
+                    return
+                status, error = await self._send(target.tg_id, target.text or job.text)
+                results.append({"id": target.id, "status": status, "error": error})
+
+        await asyncio.gather(*(sender() for _ in range(self.concurrency)))
+        return results
+
+    async def _send(self, chat_id, text):
+        for attempt in range(1, self.MAX_ATTEMPTS + 1):
+            await self.limiter.acquire()
+            try:
+                await self._bot.send_message(chat_id=chat_id, text=text)
+            except TelegramRetryAfter as e:
+                self.retries += 1
+                self.limiter.pause(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                self.retries += 1
+                if attempt == self.MAX_ATTEMPTS:
+                    self.failed += 1
+                    return "failed", str(e)[:200]
+                await asyncio.sleep(2 ** attempt)
+            except TelegramAPIError as e:
+                # Бот заблокирован, чат не найден и т.п. — повтор не поможет
+                self.failed += 1
+                return "failed", str(e)[:200]
+            else:
+                self.sent += 1
+                return "sent", None
+        self.failed += 1
+        return "failed", "Превышено число попыток"
+
+    async def _report(self, progress, final=False):
+        loop = asyncio.get_running_loop()
+        if not progress.message_id or (not final and loop.time() - progress.reported_at < self.PROGRESS_INTERVAL):
+            return
+        progress.reported_at = loop.time()
+        await self._safe(self._bot.edit_message_text(
+            chat_id=progress.job.admin_chat_id, message_id=progress.message_id, text=progress.text(final)
+        ))
+
+    @staticmethod
+    async def _safe(call):
+        # Сообщение о ходе рассылки не должно останавливать саму рассылку
+        try:
+            return await call
+        except TelegramBadRequest:
+            return None  # Например, текст не изменился
+        except TelegramAPIError as e:
+            logger.warning('Не удалось обновить сообщение о рассылке: %s', e)
+            return None
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'rate': self.rate,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retries': self.retries,
+        }
+
+
+class Progress:
+    def __init__(self, job, total, sent, failed):
+        self.job = job
+        self.total = total
+        self.sent = sent
+        self.failed = failed
+        self.message_id = job.status_message_id
+        self.reported_at = 0.0
+
+    def add(self, results):
+        for result in results:
+            if result["status"] == "sent":
+                self.sent += 1
+            else:
+                self.failed += 1
+
+    def text(self, final=False):
+        head = "✅ Рассылка завершена" if final else "📨 Идет рассылка"
+        return (f"{head}: {self.job.title}\n"
+                f"Отправлено: {self.sent} из {self.total}, ошибок: {self.failed}")
+
+
+broadcaster = Broadcaster()
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_on_commit(session):
+    # Новая рассылка видна другим соединениям только после commit всей транзакции
+    if not session.in_nested_transaction() and session.info.pop('broadcast_created', False):
+        broadcaster.wake()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_broadcast(session):
+    if not session.in_nested_transaction():
+        session.info.pop('broadcast_created', None)
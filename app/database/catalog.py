@@ -0,0 +1,168 @@
+import asyncio
+from typing import NamedTuple
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from app.database.models import async_session, Category, Podcategory, Item
+
+
+class CatalogCategory(NamedTuple):
+    id: int
+    name: str
+
+
+class CatalogPodcategory(NamedTuple):
+    id: int
+    name: str
+    category: int
+
+
+class CatalogItem(NamedTuple):
+    id: int
+    name: str
+    description: str
+    price: int
+    weight: float
+    podcategory: int
+
+
+class CatalogCache:
+    """Кэш каталога (категории, подкатегории, товары) в памяти процесса.
+
+    Каталог загружается целиком тремя запросами и хранится в кортежах.
+    После изменения цен или каталога кэш сбрасывается и при следующем
+    обращении загружается заново.
+    """
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._categories = None
+        self._podcategories = {}  # category_id -> кортеж подкатегорий
+        self._items = {}  # item_id -> CatalogItem
+        self._items_by_podcategory = {}  # podcategory_id -> кортеж товаров по id
+        self._item_ids_by_podcategory = {}  # podcategory_id -> кортеж id для bisect
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def loaded(self):
+        return self._categories is not None
+
+    async def load(self):
+        """Загружает каталог из базы. Читает только закоммиченные данные."""
+        generation = self.invalidations
+        async with async_session() as session:
+            categories = (await session.execute(
+                select(Category.id, Category.name).order_by(Category.id)
+            )).all()
+            podcategories = (await session.execute(
+                select(Podcategory.id, Podcategory.name, Podcategory.category).order_by(Podcategory.id)
+            )).all()
+            items = (await session.execute(
+                select(Item.id, Item.name, Item.description, Item.price, Item.weight, Item.podcategory)
+                .order_by(Item.id)
+            )).all()
+
+        by_category = {}
+        for row in podcategories:
+            by_category.setdefault(row.category, []).append(CatalogPodcategory(*row))
+        by_podcategory = {}
+        items_by_id = {}
+        for row in items:
+            item = CatalogItem(*row)
+            items_by_id[item.id] = item
+            by_podcategory.setdefault(item.podcategory, []).append(item)
+
+        if generation != self.invalidations:
+            # Каталог изменился во время загрузки — эти данные уже устарели
+            return
+        self._podcategories = {key: tuple(value) for key, value in by_category.items()}
+        self._items_by_podcategory = {key: tuple(value) for key, value in by_podcategory.items()}
+        self._item_ids_by_podcategory = {
+            key: tuple(item.id for item in value) for key, value in by_podcategory.items()
+        }
+        self._items = items_by_id
+        self._categories = tuple(CatalogCategory(*row) for row in categories)
+
+    async def _ensure_loaded(self):
+        if self.loaded:
+            self.hits += 1
+            return
+        self.misses += 1
+        async with self._lock:
+            while not self.loaded:
+                await self.load()
+
+    def invalidate(self):
+        """Сбрасывает кэш; каталог перечитается при следующем обращении."""
+        self._categories = None
+        self.invalidations += 1
+
+    async def categories(self):
+        await self._ensure_loaded()
+        return self._categories
+
+    async def podcategories(self, category_id):
+        await self._ensure_loaded()
+        return self._podcategories.get(category_id, ())
+
+    async def items(self, podcategory_id):
+        await self._ensure_loaded()
+        return self._items_by_podcategory.get(podcategory_id, ())
+
+    async def item_ids(self, podcategory_id):
+        await self._ensure_loaded()
+        return self._item_ids_by_podcategory.get(podcategory_id, ())
+
+    async def item(self, item_id):
+        await self._ensure_loaded()
+        return self._items.get(item_id)
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'items': len(self._items) if self.loaded else 0,
+        }
+
+
+catalog = CatalogCache()
+
+CATALOG_MODELS = (Category, Podcategory, Item)
+
+
+def mark_catalog_changed(session):
+    """Помечает транзакцию как меняющую каталог (для Core-запросов).
+
+    Кэш сбросится после commit, чтобы параллельные апдейты не закэшировали
+    старые данные до того, как изменения станут видны.
+    """
+    session.info['catalog_changed'] = True
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_catalog_changes(session, flush_context):
+    # Правки каталога через ORM помечаются автоматически
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, CATALOG_MODELS):
+            session.info['catalog_changed'] = True
+            return
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_catalog_on_commit(session):
+    # Событие приходит и для точки сохранения; ждем commit всей транзакции
+    if session.in_nested_transaction():
+        return
+    if session.info.pop('catalog_changed', False):
+        catalog.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_catalog_changes(session):
+    # Откат точки сохранения не отменяет изменений, сделанных до нее
+    if not session.in_nested_transaction():
+        session.info.pop('catalog_changed', None)
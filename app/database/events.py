@@ -0,0 +1,173 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+
+from app.database.models import async_session, Event
+from app.database.writer import write_queue
+
+
+logger = logging.getLogger(__name__)
+
+
+class EventSink:
+    """Фоновая запись журнала событий пачками.
+
+    Обработчики кладут события в очередь и не ждут записи в базу.
+    Фоновая задача сбрасывает очередь в таблицу events одним пакетным
+    INSERT, когда набралось batch_size событий или прошло flush_interval
+    секунд. Если очередь заполнена, put ждет освобождения места.
+
+    События апдейта копятся в его сессии (defer) и попадают в очередь только
+    после commit: при rollback они отбрасываются вместе с изменениями
+    обработчика. Пока работает единственный писатель, пачки пишутся через него.
+    """
+    POLL_INTERVAL = 0.05  # Как часто проверять очередь, пока копится пачка
+
+    def __init__(self, max_queue=10_000, batch_size=500, flush_interval=1.0):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = None
+        self._task = None
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.blocked = 0  # Сколько раз put ждал из-за полной очереди
+        self.discarded = 0  # События откаченных апдейтов
+        self._waiting = set()  # Отложенные put событий, не поместившихся в очередь
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run(), name='event-sink')
+
+    async def stop(self):
+        """Останавливает запись и сбрасывает в базу все, что осталось в очереди."""
+        if not self.running:
+            return
+        await self._queue.put(None)  # Сигнал остановки встает в очередь после всех событий
+        await self._task
+        self._task = None
+
+    async def put(self, user_id, event_type, description, business_id=None):
+        row = _row(user_id, event_type, description, business_id)
+        if self._queue.full():
+            self.blocked += 1
+        await self._queue.put(row)
+        self.enqueued += 1
+
+    def defer(self, session, user_id, event_type, description, business_id=None):
+        """Ставит событие в очередь после commit сессии; при rollback оно отбрасывается."""
+        row = _row(user_id, event_type, description, business_id)
+        session.info.setdefault('events_pending', []).append((self, row))
+
+    def _offer(self, row):
+        # Вызывается из обработчика commit, поэтому ждать места в очереди нельзя
+        if not self.running:
+            self.failed += 1
+            logger.error('Событие %s потеряно: запись журнала остановлена', row['event_type'])
+            return
+        try:
+            self._queue.put_nowait(row)
+        except asyncio.QueueFull:
+            self.blocked += 1
+            task = asyncio.get_running_loop().create_task(self._queue.put(row))
+            self._waiting.add(task)
+            task.add_done_callback(self._waiting.discard)
+        self.enqueued += 1
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            row = await self._queue.get()
+            if row is None:
+                return
+
+            # Копим пачку, пока она не заполнится или не истечет интервал
+            batch = [row]
+            deadline = loop.time() + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size and not stopping:
+                if self._queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    await asyncio.sleep(min(timeout, self.POLL_INTERVAL))
+                    continue
+                row = self._queue.get_nowait()
+                if row is None:
+                    stopping = True
+                else:
+                    batch.append(row)
+
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch):
+        try:
+            if write_queue.running:
+                await write_queue.submit(_insert_events, batch)
+            else:
+                async with async_session() as session:
+                    await _insert_events(session, batch)
+                    await session.commit()
+        except Exception:
+            self.failed += len(batch)
+            logger.exception('Не удалось записать %s событий', len(batch))
+        else:
+            self.written += len(batch)
+            self.batches += 1
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'depth': self._queue.qsize() if self._queue else 0,
+            'max_queue': self.max_queue,
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'batches': self.batches,
+            'failed': self.failed,
+            'blocked': self.blocked,
+            'discarded': self.discarded,
+        }
+
+
+event_sink = EventSink()
+
+
+def _row(user_id, event_type, description, business_id):
+    return {
+        'user_id': user_id,
+        'business_id': business_id,
+        'event_type': event_type,
+        'description': description,
+        'timestamp': datetime.utcnow(),  # Время события, а не время записи
+    }
+
+
+async def _insert_events(session, batch):
+    await session.execute(insert(Event), batch)
+
+
+@event.listens_for(Session, 'after_commit')
+def _enqueue_on_commit(session):
+    if not session.in_nested_transaction():
+        for sink, row in session.info.pop('events_pending', ()):
+            sink._offer(row)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    if not session.in_nested_transaction():
+        for sink, _ in session.info.pop('events_pending', ()):
+            sink.discarded += 1
@@ -0,0 +1,77 @@
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+class FsmCache:
+    """LRU-кэш записей FSM (app.database.requests.FsmRecord) по ключу.
+
+    Отсутствие записи не запоминается: другой процесс может в любой момент
+    начать сценарий пользователя. Запись живет не дольше ttl секунд; если
+    бот работает в нескольких процессах, DbStorage перед использованием
+    сверяет ее updated_at с базой.
+    """
+    def __init__(self, max_size=50_000, ttl=5.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # ключ -> (запись или None, момент загрузки)
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0  # Записи, которые успел изменить другой процесс
+
+    def get(self, key):
+        """Возвращает (найдено, запись)."""
+        cached = self._data.get(key)
+        if cached is None or time.monotonic() - cached[1] > self.ttl:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        self._data.move_to_end(key)
+        return True, cached[0]
+
+    def put(self, key, record):
+        if record is None:
+            self._data.pop(key, None)
+            return
+        self._data[key] = (record, time.monotonic())
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def mark_stale(self, key):
+        self._data.pop(key, None)
+        self.stale += 1
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def stats(self):
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses, 'stale': self.stale}
+
+
+fsm_cache = FsmCache()
+
+
+def invalidate_fsm(session, key):
+    """Сбрасывает запись кэша сейчас и еще раз после commit или rollback.
+
+    После rollback в кэше могла остаться незакоммиченная запись, прочитанная
+    внутри той же транзакции.
+    """
+    session.info.setdefault('fsm_invalidate', set()).add(key)
+    fsm_cache.invalidate(key)
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _invalidate_fsm_on_end(session):
+    # Точка сохранения транзакцию не завершает: ключи сбрасываются, но
+    # остаются до commit или rollback всей транзакции
+    if session.in_nested_transaction():
+        pending = session.info.get('fsm_invalidate', ())
+    else:
+        pending = session.info.pop('fsm_invalidate', ())
+    for key in pending:
+        fsm_cache.invalidate(key)
@@ -0,0 +1,110 @@
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+class Identity(NamedTuple):
+    """Неизменяемые данные пользователя: кто он и какой у него бизнес."""
+    user_id: int
+    tg_id: int
+    business_id: Optional[int]
+    business_type: Optional[str]
+    business_name: Optional[str]
+
+
+class IdentityCache:
+    """LRU-кэш tg_id -> Identity.
+
+    Балансы в кэш не попадают — их всегда читают из базы. Кэш сбрасывается
+    при привязке бизнеса к пользователю и при переименовании бизнеса, но
+    только в своем процессе, поэтому запись живет не дольше ttl секунд:
+    за это время изменение из другого процесса станет видно и здесь.
+    """
+    def __init__(self, max_size=50_000, ttl=30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # tg_id -> (Identity, момент загрузки)
+        self._by_business = {}  # business_id -> множество tg_id
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def get(self, tg_id):
+        cached = self._data.get(tg_id)
+        if cached is not None and time.monotonic() - cached[1] > self.ttl:
+            self.invalidate_user(tg_id)
+            self.expired += 1
+            cached = None
+        if cached is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._data.move_to_end(tg_id)
+        return cached[0]
+
+    def put(self, identity):
+        self.invalidate_user(identity.tg_id)
+        self._data[identity.tg_id] = (identity, time.monotonic())
+        if identity.business_id is not None:
+            self._by_business.setdefault(identity.business_id, set()).add(identity.tg_id)
+        while len(self._data) > self.max_size:
+            oldest = next(iter(self._data))
+            self.invalidate_user(oldest)
+            self.evictions += 1
+
+    def invalidate_user(self, tg_id):
+        identity, _ = self._data.pop(tg_id, (None, None))
+        if identity is not None and identity.business_id is not None:
+            owners = self._by_business.get(identity.business_id)
+            if owners is not None:
+                owners.discard(tg_id)
+                if not owners:
+                    del self._by_business[identity.business_id]
+
+    def invalidate_business(self, business_id):
+        for tg_id in list(self._by_business.get(business_id, ())):
+            self.invalidate_user(tg_id)
+
+    def stats(self):
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'expired': self.expired}
+
+
+identity_cache = IdentityCache()
+
+
+def invalidate_identity(session, tg_id=None, business_id=None):
+    """Сбрасывает записи кэша сейчас и еще раз после commit или rollback.
+
+    Повторный сброс нужен, чтобы параллельный апдейт, прочитавший старые
+    данные до commit, не оставил их в кэше, а после rollback — чтобы в кэше
+    не остались незакоммиченные данные, прочитанные в этой же транзакции.
+    """
+    pending = session.info.setdefault('identity_invalidate', [])
+    pending.append((tg_id, business_id))
+    _invalidate(tg_id, business_id)
+
+
+def _invalidate(tg_id, business_id):
+    if tg_id is not None:
+        identity_cache.invalidate_user(tg_id)
+    if business_id is not None:
+        identity_cache.invalidate_business(business_id)
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _invalidate_identity_on_end(session):
+    # После rollback тоже: внутри транзакции в кэш могли попасть незакоммиченные
+    # данные (например, get_identity сразу после rename_business). Точка
+    # сохранения транзакцию не завершает, поэтому список пока сохраняется.
+    if session.in_nested_transaction():
+        pending = session.info.get('identity_invalidate', ())
+    else:
+        pending = session.info.pop('identity_invalidate', ())
+    for tg_id, business_id in pending:
+        _invalidate(tg_id, business_id)
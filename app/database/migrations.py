@@ -0,0 +1,150 @@
+"""Версионные миграции схемы.
+
+Версия схемы хранится в однострочной таблице schema_version. При старте
+читается только эта строка; если версия актуальна, база больше не
+трогается. Иначе недостающие миграции применяются по порядку в одной
+транзакции вместе с обновлением версии.
+
+Чтобы изменить схему, допишите функцию в конец MIGRATIONS. Уже выпущенные
+миграции не меняются: на рабочих базах они больше не выполнятся.
+"""
+import logging
+
+from sqlalchemy import Column, Integer, MetaData, Table, func, inspect, select, text
+from sqlalchemy.exc import DBAPIError
+
+from app.database.models import Base, Cart, Broadcast, BroadcastRecipient, OutboxMessage, FsmState, get_engine
+
+
+logger = logging.getLogger(__name__)
+
+schema_version = Table(
+    'schema_version', MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('version', Integer, nullable=False),
+)
+
+
+# Таблицы схемы версии 1. Список не меняется: таблицы, появившиеся позже,
+# создают свои миграции
+BASELINE_TABLES = (
+    'users', 'businesses', 'cart', 'categories', 'podcategories', 'items',
+    'price_history', 'events', 'processed_callbacks', 'event_rollups',
+)
+
+
+def _baseline(conn):
+    """Схема до появления версий: таблицы BASELINE_TABLES и их индексы.
+
+    На пустой базе создает их с нуля, на старой — только недостающее.
+    """
+    tables = [Base.metadata.tables[name] for name in BASELINE_TABLES]
+    Base.metadata.create_all(conn, tables=tables)
+    create_missing_indexes(conn, tables)
+
+
+def create_missing_indexes(conn, tables):
+    """Создает индексы, которых нет в уже существующей базе.
+
+    create_all создает индексы только вместе с новыми таблицами, поэтому для
+    старых баз индексы добавляются отдельно. Перед созданием уникального
+    индекса корзины дубликаты (пользователь, товар) схлопываются в одну строку.
+    """
+    inspector = inspect(conn)
+    for table in tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.name == 'uq_cart_user_item':
+                _merge_duplicate_cart_rows(conn)
+            index.create(conn)
+
+
+def _merge_duplicate_cart_rows(conn):
+    cart = Cart.__table__
+    duplicates = conn.execute(
+        select(cart.c.user_id, cart.c.item_id, func.min(cart.c.id), func.sum(cart.c.quantity))
+        .group_by(cart.c.user_id, cart.c.item_id)
+        .having(func.count() > 1)
+    ).all()
+    for user_id, item_id, keep_id, quantity in duplicates:
+        conn.execute(cart.update().where(cart.c.id == keep_id).values(quantity=quantity))
+        conn.execute(cart.delete().where(
+            cart.c.user_id == user_id, cart.c.item_id == item_id, cart.c.id != keep_id
+        ))
+
+
+def _broadcasts(conn):
+    """Таблицы рассылок: broadcasts и broadcast_recipients."""
+    Broadcast.__table__.create(conn, checkfirst=True)
+    BroadcastRecipient.__table__.create(conn, checkfirst=True)
+
+
+def _outbox(conn):
+    """Таблица исходящих сообщений outbox."""
+    OutboxMessage.__table__.create(conn, checkfirst=True)
+
+
+def _outbox_topic(conn):
+    """Колонка outbox.topic — хэштег поста в канал для сводок."""
+    if 'topic' not in {column['name'] for column in inspect(conn).get_columns('outbox')}:
+        conn.execute(text('ALTER TABLE outbox ADD COLUMN topic VARCHAR(64)'))
+
+
+def _fsm_states(conn):
+    """Таблица состояний FSM fsm_states."""
+    FsmState.__table__.create(conn, checkfirst=True)
+
+
+# Миграция с номером N переводит схему с версии N - 1 на N
+MIGRATIONS = [
+    _baseline,  # 1
+    _broadcasts,  # 2
+    _outbox,  # 3
+    _outbox_topic,  # 4
+    _fsm_states,  # 5
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+async def get_schema_version(engine):
+    """Читает версию схемы; 0 — база еще не под управлением миграций."""
+    async with engine.connect() as conn:
+        try:
+            return await conn.scalar(select(schema_version.c.version)) or 0
+        except DBAPIError:
+            return 0  # Таблицы schema_version нет
+
+
+def _apply(conn, current):
+    schema_version.create(conn, checkfirst=True)
+    for version in range(current + 1, LATEST_VERSION + 1):
+        MIGRATIONS[version - 1](conn)
+        if version == 1:
+            conn.execute(schema_version.insert().values(id=1, version=version))
+        else:
+            conn.execute(schema_version.update().values(version=version))
+        logger.info('Схема БД обновлена до версии %s', version)
+
+
+async def migrate(engine=None):
+    """Применяет недостающие миграции. Возвращает итоговую версию схемы."""
+    engine = engine or get_engine()
+    current = await get_schema_version(engine)
+    if current >= LATEST_VERSION:
+        return current
+
+    async with engine.begin() as conn:
+        # Версию перечитываем в транзакции: ее мог поднять другой процесс
+        current = await conn.run_sync(_current_version)
+        if current < LATEST_VERSION:
+            await conn.run_sync(_apply, current)
+    return LATEST_VERSION
+
+
+def _current_version(conn):
+    if not inspect(conn).has_table('schema_version'):
+        return 0
+    return conn.execute(select(schema_version.c.version)).scalar() or 0
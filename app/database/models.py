@@ -1,16 +1,44 @@
-from sqlalchemy import BigInteger, String, ForeignKey, Integer, DateTime
+from sqlalchemy import BigInteger, String, ForeignKey, Integer, DateTime, Date, Index
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy.ext.asyncio import AsyncAttrs,async_sessionmaker,create_async_engine
-from datetime import datetime
+from sqlalchemy.ext.asyncio import AsyncAttrs,async_sessionmaker
+from datetime import datetime, date
 
 from dotenv import load_dotenv
 import os
 
-load_dotenv()
+from app.database.profiles import create_engine
 
-engine = create_async_engine(url=os.getenv('SQLALCHEMY_URL'))
 
-async_session = async_sessionmaker(engine)
+_engine = None
+
+
+def get_engine():
+    """Возвращает движок БД, создавая его при первом обращении.
+
+    Импорт моделей не читает .env и не подключает драйвер базы, поэтому
+    скрипты и инструменты могут импортировать пакет без побочных эффектов.
+    Настройки движка берутся из профиля DB_PROFILE (app.database.profiles).
+    """
+    global _engine
+    if _engine is None:
+        load_dotenv()
+        _engine = create_engine(os.getenv('SQLALCHEMY_URL'), os.getenv('DB_PROFILE'))
+    return _engine
+
+
+class LazySessionmaker:
+    """async_sessionmaker, который привязывается к движку при первом вызове."""
+    def __init__(self, **options):
+        self.options = options
+        self._sessionmaker = None
+
+    def __call__(self, **kwargs):
+        if self._sessionmaker is None:
+            self._sessionmaker = async_sessionmaker(get_engine(), **self.options)
+        return self._sessionmaker(**kwargs)
+
+
+async_session = LazySessionmaker(expire_on_commit=False)
 
 class Base(AsyncAttrs, DeclarativeBase):
     pass
@@ -21,7 +49,7 @@ class User(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True)
     tg_id = mapped_column(BigInteger, unique=True)
-    business_id: Mapped[int] = mapped_column(ForeignKey('businesses.id'), nullable=True)
+    business_id: Mapped[int] = mapped_column(ForeignKey('businesses.id'), nullable=True, index=True)
     business = relationship(
         'Business',
         back_populates='users',
@@ -34,7 +62,7 @@ class Business(Base):
     __tablename__ = 'businesses'
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    type: Mapped[str] = mapped_column(String(50))  # Тип бизнеса
+    type: Mapped[str] = mapped_column(String(50), index=True)  # Тип бизнеса
     name: Mapped[str] = mapped_column(String(50))  # Название компании
     budget: Mapped[int] = mapped_column(Integer, default=0)  # Бюджет
     income: Mapped[int] = mapped_column(Integer, default=0)  #Доходы
@@ -49,9 +77,12 @@ class Cart(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('users.id'))
-    item_id: Mapped[int] = mapped_column(ForeignKey('items.id'))
+    item_id: Mapped[int] = mapped_column(ForeignKey('items.id'), index=True)
     quantity: Mapped[int] = mapped_column(default=1)
 
+    # Одна строка на пару (пользователь, товар) — add_to_cart делает upsert
+    __table_args__ = (Index('uq_cart_user_item', 'user_id', 'item_id', unique=True),)
+
     user = relationship('User', back_populates='cart')
     item = relationship('Item')
 
@@ -70,7 +101,7 @@ class Podcategory(Base):
 
     id: Mapped[int]= mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(25))
-    category: Mapped[int] = mapped_column(ForeignKey('categories.id'))
+    category: Mapped[int] = mapped_column(ForeignKey('categories.id'), index=True)
 
 
 
@@ -82,7 +113,20 @@ class Item(Base):
     description: Mapped[str] = mapped_column(String(120))
     price: Mapped[int] = mapped_column()
     weight: Mapped[float] = mapped_column(default=0.0)  # Вес в кг, теперь с плавающей точкой
-    podcategory: Mapped[int] = mapped_column(ForeignKey('podcategories.id'))
+    podcategory: Mapped[int] = mapped_column(ForeignKey('podcategories.id'), index=True)
+
+
+
+class PriceHistory(Base):
+    __tablename__ = 'price_history'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    item_id: Mapped[int] = mapped_column(ForeignKey('items.id'))
+    old_price: Mapped[int] = mapped_column()  # Цена до изменения
+    new_price: Mapped[int] = mapped_column()  # Цена после изменения
+    changed_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (Index('ix_price_history_item_changed', 'item_id', 'changed_at'),)
 
 
 
@@ -91,16 +135,97 @@ class Event(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)  # Добавляем аннотацию типа int
     user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.id"))
-    business_id: Mapped[int] = mapped_column(ForeignKey("businesses.id"), nullable=True)
+    business_id: Mapped[int] = mapped_column(ForeignKey("businesses.id"), nullable=True, index=True)
     event_type: Mapped[str] = mapped_column(String)  # Тип события (например, "rename_business" или "make_order")
     description: Mapped[str] = mapped_column(String)  # Подробности события
-    timestamp: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)  # Время события
+    timestamp: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)  # Время события
 
     user = relationship("User")  # Связь с моделью User
     business = relationship("Business")  # Связь с моделью Business
 
-    
 
-async def async_main():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+
+class ProcessedCallback(Base):
+    """Выполненные идемпотентные операции по нажатию кнопок."""
+    __tablename__ = "processed_callbacks"
+
+    key: Mapped[str] = mapped_column(String(100), primary_key=True)  # чат:сообщение:callback_data
+    result: Mapped[str] = mapped_column(String(200))  # Ответ, который получит повторное нажатие
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+
+
+
+class EventRollup(Base):
+    """Свертка архивированных событий: количество по бизнесу, типу и дню."""
+    __tablename__ = "event_rollups"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    business_id: Mapped[int] = mapped_column(ForeignKey("businesses.id"), nullable=True)
+    event_type: Mapped[str] = mapped_column(String(50))
+    day: Mapped[date] = mapped_column(Date)
+    count: Mapped[int] = mapped_column(Integer, default=0)
+
+    __table_args__ = (Index('ix_event_rollups_key', 'day', 'business_id', 'event_type'),)
+
+
+
+class Broadcast(Base):
+    """Рассылка сообщений игрокам; по ней рассылку можно продолжить после сбоя."""
+    __tablename__ = "broadcasts"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    title: Mapped[str] = mapped_column(String(100))  # Что рассылаем — для сообщения о ходе рассылки
+    text: Mapped[str] = mapped_column(String, nullable=True)  # Общий текст, если у получателя нет своего
+    status: Mapped[str] = mapped_column(String(20), default='pending', index=True)  # pending, running, done
+    admin_chat_id: Mapped[int] = mapped_column(BigInteger, nullable=True)  # Куда писать о ходе рассылки
+    status_message_id: Mapped[int] = mapped_column(Integer, nullable=True)  # Сообщение, которое редактируется
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    finished_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+
+
+class BroadcastRecipient(Base):
+    __tablename__ = "broadcast_recipients"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    broadcast_id: Mapped[int] = mapped_column(ForeignKey("broadcasts.id"))
+    tg_id: Mapped[int] = mapped_column(BigInteger)
+    text: Mapped[str] = mapped_column(String, nullable=True)  # Личный текст (например, сумма списания)
+    status: Mapped[str] = mapped_column(String(20), default='pending')  # pending, sent, failed
+    error: Mapped[str] = mapped_column(String(200), nullable=True)
+
+    # Следующая страница неотправленных получателей читается по индексу
+    __table_args__ = (Index('ix_broadcast_recipients_pending', 'broadcast_id', 'status', 'id'),)
+
+
+
+class OutboxMessage(Base):
+    """Исходящее сообщение Telegram, записанное в одной транзакции с изменением.
+
+    Отправляет app.outbox.dispatcher после commit; при ошибке — с повторами.
+    """
+    __tablename__ = "outbox"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    chat_id: Mapped[int] = mapped_column(BigInteger, nullable=True)  # NULL — канал CHANNEL_ID
+    text: Mapped[str] = mapped_column(String)
+    reply_markup: Mapped[str] = mapped_column(String, nullable=True)  # Клавиатура в JSON
+    topic: Mapped[str] = mapped_column(String(64), nullable=True)  # Хэштег поста в канал, для сводки
+    status: Mapped[str] = mapped_column(String(20), default='pending')  # pending, sent, failed
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    error: Mapped[str] = mapped_column(String(200), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    sent_at: Mapped[datetime] = mapped_column(DateTime, nullable=True, index=True)
+
+    __table_args__ = (Index('ix_outbox_due', 'status', 'next_attempt_at'),)
+
+
+class FsmState(Base):
+    """Состояние FSM aiogram (app.storage.DbStorage): общее для процессов и перезапусков."""
+    __tablename__ = "fsm_states"
+
+    key: Mapped[str] = mapped_column(String(100), primary_key=True)  # бот:чат:пользователь[:тред][:destiny]
+    state: Mapped[str] = mapped_column(String(100), nullable=True)
+    data: Mapped[str] = mapped_column(String, nullable=True)  # Компактный JSON, NULL — пусто
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
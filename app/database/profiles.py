@@ -0,0 +1,126 @@
+"""Именованные профили настройки движка БД.
+
+Профиль выбирается переменной окружения DB_PROFILE. Если она не задана,
+берется профиль по умолчанию для драйвера из SQLALCHEMY_URL.
+
+    sqlite-dev     SQLite для разработки: только ожидание блокировки
+                   и явный BEGIN (см. _install_begin)
+    sqlite-prod    SQLite в WAL: читатели не ждут писателя, fsync реже;
+                   транзакции с записью открываются BEGIN IMMEDIATE
+                   (писатели ждут друг друга до busy_timeout, а не падают
+                   с "database is locked"), чтение — BEGIN DEFERRED
+    sqlite-queue   как sqlite-prod, но все записи идут через одного писателя
+                   (app.database.writer), а чтение — без блокировки записи
+    postgres-prod  PostgreSQL (asyncpg): размер пула, pre-ping, кэш
+                   подготовленных запросов
+"""
+from typing import NamedTuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+
+class EngineProfile(NamedTuple):
+    backend: str  # Имя диалекта: sqlite или postgresql
+    engine_options: dict  # Аргументы create_async_engine
+    pragmas: dict  # PRAGMA для каждого нового соединения SQLite
+    sqlite_begin: str = None  # Режим BEGIN для SQLite: None — как решит драйвер
+    write_queue: bool = False  # Писать через единственного писателя
+
+
+SQLITE_PROD_PRAGMAS = {
+    'journal_mode': 'WAL',  # Чтение не блокируется записью
+    'synchronous': 'NORMAL',  # В WAL безопасно: теряется не больше последней транзакции при сбое ОС
+    'busy_timeout': 5000,  # Мс ожидания блокировки вместо мгновенного "database is locked"
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -32 * 1024,  # 32 МБ кэша страниц на соединение
+    'temp_store': 'MEMORY',
+}
+
+PROFILES = {
+    'sqlite-dev': EngineProfile(
+        backend='sqlite',
+        engine_options={},
+        pragmas={'busy_timeout': 5000},
+        # Без явного BEGIN точка сохранения внутри сессии апдейта становится
+        # внешней транзакцией, и ее RELEASE сразу коммитит изменения
+        sqlite_begin='DEFERRED',
+    ),
+    'sqlite-prod': EngineProfile(
+        backend='sqlite',
+        engine_options={},
+        pragmas=SQLITE_PROD_PRAGMAS,
+        # Чтение не берет блокировку записи; функции с write=True открывают
+        # транзакцию с IMMEDIATE (app.database.requests._begin_write)
+        sqlite_begin='DEFERRED',
+    ),
+    'sqlite-queue': EngineProfile(
+        backend='sqlite',
+        engine_options={},
+        pragmas=SQLITE_PROD_PRAGMAS,
+        sqlite_begin='DEFERRED',  # Писатель сам открывает транзакцию с IMMEDIATE
+        write_queue=True,
+    ),
+    'postgres-prod': EngineProfile(
+        backend='postgresql',
+        engine_options={
+            'pool_size': 10,
+            'max_overflow': 20,
+            'pool_timeout': 10,
+            'pool_pre_ping': True,  # Отбрасывать соединения, закрытые сервером или балансировщиком
+            'pool_recycle': 1800,
+            'connect_args': {'prepared_statement_cache_size': 500},
+        },
+        pragmas={},
+    ),
+}
+
+DEFAULT_PROFILES = {'sqlite': 'sqlite-dev', 'postgresql': 'postgres-prod'}
+
+
+def resolve_profile(url, name=None):
+    """Возвращает (имя, профиль) для URL; name=None — профиль по умолчанию."""
+    backend = make_url(url).get_backend_name()
+    name = name or DEFAULT_PROFILES.get(backend)
+    if name is None:
+        return None, EngineProfile(backend, {}, {})
+    if name not in PROFILES:
+        raise ValueError(f"Неизвестный профиль БД {name!r}, доступны: {', '.join(PROFILES)}")
+    profile = PROFILES[name]
+    if profile.backend != backend:
+        raise ValueError(f"Профиль {name!r} рассчитан на {profile.backend}, а SQLALCHEMY_URL — {backend}")
+    return name, profile
+
+
+def create_engine(url, profile_name=None):
+    """Создает AsyncEngine с настройками профиля."""
+    _, profile = resolve_profile(url, profile_name)
+    engine = create_async_engine(url, **profile.engine_options)
+    if profile.pragmas:
+        _install_pragmas(engine, profile.pragmas)
+    if profile.sqlite_begin:
+        _install_begin(engine, profile.sqlite_begin)
+    return engine
+
+
+def _install_pragmas(engine, pragmas):
+    @event.listens_for(engine.sync_engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+def _install_begin(engine, mode):
+    # Драйвер sqlite3 сам решает, когда открыть транзакцию, и не открывает ее
+    # перед SELECT и SAVEPOINT; отключаем это и шлем BEGIN при начале транзакции.
+    # Режим можно переопределить для соединения: execution_options(sqlite_begin=...)
+    @event.listens_for(engine.sync_engine, 'connect')
+    def disable_driver_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine.sync_engine, 'begin')
+    def begin(connection):
+        connection.exec_driver_sql(f"BEGIN {connection.get_execution_options().get('sqlite_begin', mode)}")
@@ -0,0 +1,61 @@
+"""Неизменяемые записи для чтения (read model).
+
+Запросы, которые возвращают эти записи, выбирают только нужные колонки и
+не создают ORM-объекты: нет identity map, отслеживания изменений и
+selectin-загрузки связей User <-> Business. Записи хранят поля в __slots__
+и после создания не меняются.
+"""
+
+
+class Record:
+    """Базовая запись: поля перечисляются в __slots__ наследника."""
+    __slots__ = ()
+
+    def __init__(self, *values):
+        if len(values) != len(self.__slots__):
+            raise TypeError(f'{type(self).__name__} ожидает {len(self.__slots__)} значений, получено {len(values)}')
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    @classmethod
+    def from_rows(cls, rows):
+        return tuple(cls(*row) for row in rows)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} нельзя изменить')
+
+    __delattr__ = __setattr__
+
+    def _values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._values() == other._values()
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+
+class BusinessEntry(Record):
+    """Строка списка бизнесов для клавиатур."""
+    __slots__ = ('id', 'type', 'name')
+
+
+class UserEntry(Record):
+    __slots__ = ('id', 'tg_id', 'business_id')
+
+
+class BalanceCard(Record):
+    """Карточка /my_business: тип, название и текущие деньги бизнеса."""
+    __slots__ = ('business_id', 'type', 'name', 'budget', 'expenses')
+
+
+class BusinessContact(Record):
+    """Бизнес и его владелец (первый привязанный пользователь) для уведомлений."""
+    __slots__ = ('id', 'type', 'name', 'owner_user_id', 'owner_tg_id')
@@ -0,0 +1,57 @@
+from typing import NamedTuple
+
+from sqlalchemy import select, func
+
+from app.database.models import Business
+from app.database.requests import connection
+
+
+class CompanyRow(NamedTuple):
+    id: int
+    name: str
+    type: str
+    budget: int
+    income: int
+    cost: int
+    profit: int
+
+
+class TypeSummary(NamedTuple):
+    type: str
+    count: int
+    budget: int
+    income: int
+    cost: int
+    profit: int
+
+
+class BusinessReport(NamedTuple):
+    companies: list  # CompanyRow, по убыванию прибыли
+    summaries: list  # TypeSummary, по убыванию общей прибыли
+
+
+@connection
+async def get_business_report(session):
+    """Собирает отчет по всем компаниям, включая компании без владельца.
+
+    Прибыль, сортировка и итоги по типам считаются в базе (ORDER BY / GROUP BY),
+    ORM-объекты не создаются.
+    """
+    profit = (Business.income - Business.cost).label('profit')
+    companies = await session.execute(
+        select(Business.id, Business.name, Business.type, Business.budget,
+               Business.income, Business.cost, profit)
+        .order_by(profit.desc(), Business.id)
+    )
+
+    total_profit = (func.sum(Business.income) - func.sum(Business.cost)).label('profit')
+    summaries = await session.execute(
+        select(Business.type, func.count(Business.id), func.sum(Business.budget),
+               func.sum(Business.income), func.sum(Business.cost), total_profit)
+        .group_by(Business.type)
+        .order_by(total_profit.desc(), Business.type)
+    )
+    return BusinessReport(
+        [CompanyRow(*row) for row in companies],
+        [TypeSummary(*row) for row in summaries],
+    )
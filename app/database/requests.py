@@ -1,30 +1,160 @@
 from app.database.models import async_session
-from app.database.models import User, Category, Podcategory, Item, Business, Cart, Event
-from sqlalchemy import select, delete
-from sqlalchemy.orm import selectinload
+from app.database.models import User, Category, Podcategory, Item, Business, Cart, Event, PriceHistory, ProcessedCallback
+from app.database.models import Broadcast, BroadcastRecipient, OutboxMessage, FsmState
+from app.database.catalog import catalog, mark_catalog_changed
+from app.database.events import event_sink
+from app.database.identity import Identity, identity_cache, invalidate_identity
+from app.database.fsm import invalidate_fsm
+from app.database.writer import write_queue
+from app.database.projections import BusinessEntry, UserEntry, BalanceCard, BusinessContact
+from sqlalchemy import select, delete, update, insert, and_, or_, literal, func, event
+from sqlalchemy.orm import Session, selectinload, aliased
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
 from sqlalchemy.exc import SQLAlchemyError
+from typing import NamedTuple
+from datetime import datetime
+from contextvars import ContextVar
+from functools import partial, wraps
+from bisect import bisect_left, bisect_right
+import re
 
 
-def connection(func):
+# Сессия текущего апдейта, ее выставляет DbSessionMiddleware
+current_session = ContextVar('current_session', default=None)
+
+
+def connection(func=None, *, write=False):
+    """Передает в функцию сессию текущего апдейта.
+
+    Внутри обработчика используется общая сессия апдейта: commit или rollback
+    делает middleware. Вне бота (скрипты, тесты) открывается своя сессия,
+    которая коммитится после успешного вызова.
+
+    Если запущен единственный писатель (профиль sqlite-queue), функции с
+    write=True выполняются в его транзакции, а чтение — в короткой своей
+    сессии: долгая сессия апдейта держала бы старый снимок WAL и не видела
+    только что записанное.
+
+    На SQLite транзакция открывается как BEGIN DEFERRED и блокировку записи
+    не берет; функция с write=True начинает транзакцию с BEGIN IMMEDIATE
+    (см. _begin_write).
+    """
+    if func is None:
+        return partial(connection, write=write)
+
+    @wraps(func)
     async def inner(*args, **kwargs):
-        async with async_session() as session:
+        if write_queue.running:
+            if write:
+                return await write_queue.submit(func, *args, **kwargs)
+            async with async_session() as session:
+                return await func(session, *args, **kwargs)
+
+        session = current_session.get()
+        if session is not None:
+            if write:
+                await _begin_write(session)
             return await func(session, *args, **kwargs)
+
+        async with async_session() as session:
+            if write:
+                await _begin_write(session)
+            result = await func(session, *args, **kwargs)
+            await session.commit()
+            return result
     return inner
 
 
-@connection
+async def _begin_write(session):
+    """Переводит транзакцию SQLite в режим записи перед первой записью.
+
+    DEFERRED-транзакция, которая сначала читала, не может дождаться
+    блокировки записи: если другой писатель успел закоммитить, SQLite сразу
+    отвечает "database is locked" без ожидания busy_timeout. Поэтому
+    транзакция, которая пока только читала, коммитится (терять в ней нечего),
+    и следующая открывается с BEGIN IMMEDIATE — она ждет писателя. Транзакции
+    только на чтение блокировку записи не берут вовсе.
+    """
+    if session.info.get('writing') or session.bind.dialect.name != 'sqlite':
+        return
+    if session.in_transaction():
+        if session.new or session.dirty or session.deleted:
+            return  # Есть несохраненные изменения ORM: commit здесь был бы преждевременным
+        await session.commit()
+    await session.connection(execution_options={'sqlite_begin': 'IMMEDIATE'})
+    session.info['writing'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _end_write(session):
+    # События приходят и для точек сохранения, а транзакция при этом продолжается
+    if not session.in_nested_transaction():
+        session.info.pop('writing', None)
+
+
+@connection(write=True)
 async def set_user(session, tg_id):
     user = await session.scalar(select(User).where(User.tg_id == tg_id))
     if not user:
         session.add(User(tg_id=tg_id))
-        await session.commit()
+        await session.flush()
     return user
 
 
 @connection
 async def get_all_businesses(session):
-    result = await session.scalars(select(Business))
-    return result.all()  # Преобразуем ScalarResult в список
+    """Возвращает все бизнесы как BusinessEntry (id, type, name)."""
+    result = await session.execute(select(Business.id, Business.type, Business.name).order_by(Business.id))
+    return BusinessEntry.from_rows(result)
+
+
+class Page(NamedTuple):
+    """Страница списка при keyset-пагинации."""
+    rows: tuple
+    has_prev: bool
+    has_next: bool
+
+
+BUSINESS_PAGE_SIZE = 1
+ITEMS_PAGE_SIZE = 6
+
+
+@connection
+async def get_businesses_page(session, after_id=None, before_id=None, page_size=BUSINESS_PAGE_SIZE):
+    """Возвращает страницу бизнесов (id, type, name), упорядоченных по id.
+
+    Курсор — id последней (after_id) или первой (before_id) строки текущей
+    страницы. Читается не больше page_size + 1 строк, поэтому стоимость
+    перелистывания не зависит от общего числа бизнесов.
+    """
+    stmt = select(Business.id, Business.type, Business.name).limit(page_size + 1)
+    if before_id is not None:
+        rows = (await session.execute(
+            stmt.where(Business.id < before_id).order_by(Business.id.desc())
+        )).all()
+        has_more = len(rows) > page_size
+        return Page(BusinessEntry.from_rows(reversed(rows[:page_size])), has_more, True)
+
+    if after_id is not None:
+        stmt = stmt.where(Business.id > after_id)
+    rows = (await session.execute(stmt.order_by(Business.id))).all()
+    return Page(BusinessEntry.from_rows(rows[:page_size]), after_id is not None, len(rows) > page_size)
+
+
+async def get_items_page(podcategory_id, after_id=None, before_id=None, page_size=ITEMS_PAGE_SIZE):
+    """Возвращает страницу товаров подкатегории из кэша каталога (по id)."""
+    items = await catalog.items(podcategory_id)
+    ids = await catalog.item_ids(podcategory_id)
+    if before_id is not None:
+        end = bisect_left(ids, before_id)
+        start = max(end - page_size, 0)
+        return Page(items[start:end], start > 0, end < len(items))
+
+    start = bisect_right(ids, after_id) if after_id is not None else 0
+    end = start + page_size
+    return Page(items[start:end], start > 0, end < len(items))
 
 
 @connection
@@ -39,7 +169,7 @@ async def get_courier_business_owner(session):
         return courier_business.users[0]  # Возвращаем первого пользователя (владельца)
     return None
 
-@connection
+@connection(write=True)
 async def assign_business_to_user(session, tg_id, business_id):
     """Привязывает существующий бизнес к пользователю."""
     user = await session.scalar(select(User).where(User.tg_id == tg_id))
@@ -48,17 +178,18 @@ async def assign_business_to_user(session, tg_id, business_id):
         # Автоматически создаём пользователя, если он отсутствует
         user = User(tg_id=tg_id)
         session.add(user)
-        await session.commit()  # Сохраняем пользователя в базу
+        await session.flush()  # Получаем id пользователя
 
     business = await session.scalar(select(Business).where(Business.id == business_id))
     if not business:
         raise ValueError(f"Бизнес с ID {business_id} не найден.")
 
     user.business_id = business.id
-    await session.commit()
+    await session.flush()
+    invalidate_identity(session, tg_id=tg_id)
 
 
-@connection
+@connection(write=True)
 async def rename_business(session, business_id, new_name):
     """Изменяет название бизнеса."""
     business = await session.scalar(select(Business).where(Business.id == business_id))
@@ -66,7 +197,52 @@ async def rename_business(session, business_id, new_name):
         raise ValueError(f"Бизнес с ID {business_id} не найден.")
 
     business.name = new_name
-    await session.commit()   
+    await session.flush()
+    invalidate_identity(session, business_id=business_id)
+
+
+@connection
+async def get_identity(session, tg_id):
+    """Возвращает Identity пользователя из кэша или из базы (None, если нет)."""
+    identity = identity_cache.get(tg_id)
+    if identity is not None:
+        return identity
+
+    row = (await session.execute(
+        select(User.id, User.tg_id, User.business_id, Business.type, Business.name)
+        .outerjoin(Business, User.business_id == Business.id)
+        .where(User.tg_id == tg_id)
+    )).first()
+    if row is None:
+        return None
+    identity = Identity(*row)
+    identity_cache.put(identity)
+    return identity
+
+
+class Balance(NamedTuple):
+    budget: int
+    expenses: int
+
+
+@connection
+async def get_balance(session, business_id):
+    """Читает изменяемые поля бизнеса (бюджет и траты) — они не кэшируются."""
+    row = (await session.execute(
+        select(Business.budget, Business.expenses).where(Business.id == business_id)
+    )).first()
+    return Balance(*row) if row else None
+
+
+@connection
+async def get_balance_card(session, business_id):
+    """Возвращает BalanceCard бизнеса одним запросом по первичному ключу."""
+    row = (await session.execute(
+        select(Business.id, Business.type, Business.name, Business.budget, Business.expenses)
+        .where(Business.id == business_id)
+    )).first()
+    return BalanceCard(*row) if row else None
+
 
 @connection
 async def get_user_with_business(session, tg_id):
@@ -79,8 +255,9 @@ async def get_user_with_business(session, tg_id):
 
 @connection
 async def get_users(session):
-    """Получает всех пользователей."""
-    return await session.scalars(select(User))
+    """Получает всех пользователей как UserEntry (id, tg_id, business_id)."""
+    result = await session.execute(select(User.id, User.tg_id, User.business_id).order_by(User.id))
+    return UserEntry.from_rows(result)
 
 @connection
 async def get_user_by_id(session, id):
@@ -98,6 +275,30 @@ async def get_business_by_id(session, business_id):
     return await session.scalar(select(Business).where(Business.id == business_id))
 
 
+@connection
+async def get_business_contact(session, business_id):
+    """Возвращает BusinessContact: бизнес и его первого владельца.
+
+    Вместо загрузки всех пользователей бизнеса читается один владелец
+    с наименьшим id. Если владельцев нет, owner_* равны None.
+    """
+    owners = aliased(User)
+    owner_id = (
+        select(owners.id)
+        .where(owners.business_id == Business.id)
+        .order_by(owners.id)
+        .limit(1)
+        .correlate(Business)
+        .scalar_subquery()
+    )
+    row = (await session.execute(
+        select(Business.id, Business.type, Business.name, User.id, User.tg_id)
+        .outerjoin(User, User.id == owner_id)
+        .where(Business.id == business_id)
+    )).first()
+    return BusinessContact(*row) if row else None
+
+
 @connection
 async def get_categories(session):
     return await session.scalars(select(Category))
@@ -109,9 +310,9 @@ async def get_category_item(session, category_id):
     return result.all()
         
 
-@connection
-async def get_item(session,item_id):
-    return await session.scalar(select(Item).where(Item.id == item_id))
+async def get_item(item_id):
+    """Возвращает товар из кэша каталога, без обращения к базе."""
+    return await catalog.item(item_id)
 
 @connection
 async def get_podcategories(session, category_id):
@@ -123,9 +324,22 @@ async def get_items_by_podcategory(session, podcategory_id):
     return result.all()
 
 
-@connection 
+# Диалекты с INSERT ... ON CONFLICT DO UPDATE
+UPSERT_INSERTS = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}
+
+
+@connection(write=True)
 async def add_to_cart(session, user_id, item_id, quantity):
-    """Добавляет товар в корзину."""
+    """Добавляет товар в корзину одним upsert по уникальному (user_id, item_id)."""
+    dialect_insert = UPSERT_INSERTS.get(session.bind.dialect.name)
+    if dialect_insert is not None:
+        stmt = dialect_insert(Cart).values(user_id=user_id, item_id=item_id, quantity=quantity)
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=[Cart.user_id, Cart.item_id],
+            set_={'quantity': Cart.quantity + stmt.excluded.quantity},
+        ))
+        return
+
     cart_item = await session.scalar(
         select(Cart).where(Cart.user_id == user_id, Cart.item_id == item_id)
     )
@@ -134,7 +348,7 @@ async def add_to_cart(session, user_id, item_id, quantity):
     else:
         cart_item = Cart(user_id=user_id, item_id=item_id, quantity=quantity)
         session.add(cart_item)
-    await session.commit()
+    await session.flush()
 
 
 @connection
@@ -147,15 +361,31 @@ async def get_cart(session, user_id):
 
 
 
-@connection
+@connection(write=True)
 async def clear_cart(session, user_id):
     await session.execute(delete(Cart).where(Cart.user_id == user_id))
-    await session.commit()
 
 
-@connection
-async def log_event(session, user_id, event_type, description, business_id=None):
-    """Логирует событие в базу данных."""
+async def log_event(user_id, event_type, description, business_id=None):
+    """Логирует событие в базу данных.
+
+    Если запущен фоновый event_sink, событие пишется пачкой позже: внутри
+    апдейта — только после commit его сессии, вместе с изменениями
+    обработчика. Через единственного писателя изменения уже закоммичены,
+    поэтому событие сразу встает в очередь. Без event_sink (скрипты)
+    событие пишется сразу.
+    """
+    session = current_session.get()
+    if event_sink.running and session is not None and not write_queue.running:
+        event_sink.defer(session, user_id, event_type, description, business_id)
+    elif event_sink.running:
+        await event_sink.put(user_id, event_type, description, business_id)
+    else:
+        await _insert_event(user_id, event_type, description, business_id)
+
+
+@connection(write=True)
+async def _insert_event(session, user_id, event_type, description, business_id=None):
     event = Event(
         user_id=user_id,
         business_id=business_id,
@@ -163,79 +393,170 @@ async def log_event(session, user_id, event_type, description, business_id=None)
         description=description
     )
     session.add(event)
-    await session.commit()
+    await session.flush()
 
-@connection
+
+class InsufficientFundsError(ValueError):
+    """Недостаточно средств на счете компании."""
+
+
+# Сколько раз повторяем оптимистичное списание, если бюджет успели изменить
+OPTIMISTIC_RETRIES = 5
+
+
+async def _withdraw(session, business_id, amount):
+    """Списывает деньги одним условным UPDATE и возвращает новый бюджет.
+
+    Не делает commit — транзакцией управляет вызывающий код.
+    """
+    if session.bind.dialect.update_returning:
+        new_budget = await session.scalar(
+            update(Business)
+            .where(Business.id == business_id, Business.budget >= amount)
+            .values(budget=Business.budget - amount, cost=Business.cost + amount)
+            .returning(Business.budget)
+        )
+        if new_budget is not None:
+            return new_budget
+
+        # Строка не обновилась: выясняем причину только в этом случае
+        budget = await session.scalar(select(Business.budget).where(Business.id == business_id))
+        if budget is None:
+            raise ValueError(f"Бизнес с ID {business_id} не найден.")
+        raise InsufficientFundsError(f"Недостаточно средств. Бюджет: {budget}, требуется: {amount}")
+
+    # Бэкенд без RETURNING: оптимистичная проверка, версией служит прочитанный бюджет
+    for _ in range(OPTIMISTIC_RETRIES):
+        budget = await session.scalar(select(Business.budget).where(Business.id == business_id))
+        if budget is None:
+            raise ValueError(f"Бизнес с ID {business_id} не найден.")
+        if budget < amount:
+            raise InsufficientFundsError(f"Недостаточно средств. Бюджет: {budget}, требуется: {amount}")
+
+        result = await session.execute(
+            update(Business)
+            .where(Business.id == business_id, Business.budget == budget)
+            .values(budget=budget - amount, cost=Business.cost + amount)
+        )
+        if result.rowcount == 1:
+            return budget - amount
+
+    raise ValueError(f"Не удалось списать деньги с бизнеса {business_id}: бюджет постоянно меняется.")
+
+
+async def _deposit(session, business_id, amount):
+    """Зачисляет деньги одним UPDATE. Возвращает True, если бизнес найден."""
+    result = await session.execute(
+        update(Business)
+        .where(Business.id == business_id)
+        .values(budget=Business.budget + amount, income=Business.income + amount)
+    )
+    return result.rowcount == 1
+
+
+@connection(write=True)
 async def deduct_money_from_business(session, business_id, amount):
-    """Списывает деньги с бюджета бизнеса."""
-    business = await session.scalar(select(Business).where(Business.id == business_id))
-    if not business:
-        raise ValueError(f"Бизнес с ID {business_id} не найден.")
+    """Списывает деньги с бюджета бизнеса и возвращает новый бюджет.
 
-    # Проверяем, хватает ли бюджета
-    if business.budget < amount:
-        raise ValueError(f"Недостаточно средств. Бюджет: {business.budget}, требуется: {amount}")
+    При нехватке средств бросает InsufficientFundsError.
+    """
+    new_budget = await _withdraw(session, business_id, amount)
+    return new_budget
 
-    # Списываем деньги
-    business.budget -= amount
-    business.cost += amount
-    await session.commit()
 
-@connection
+@connection(write=True)
+async def remove_money_from_company(session, business_id, amount):
+    """Снимает деньги со счета компании (операция администратора)."""
+    new_budget = await _withdraw(session, business_id, amount)
+    return new_budget
+
+
+@connection(write=True)
 async def add_money_to_company(session,  business_id, amount):
     """
     Универсальная функция для добавления денег на счет компании.
     """
     if amount <= 0:
-        return
-    
-    # Ищем бизнес по ID
-    business = await session.scalar(select(Business).where(Business.id == business_id))
-    if not business:
-        return
-    
-    # Обновляем баланс компании
-    business.budget += amount
-    business.income += amount
-    await session.commit()
+        return False
 
+    found = await _deposit(session, business_id, amount)
+    return found
 
 
-@connection
+
+class ExpenseCharge(NamedTuple):
+    """Результат ежемесячного списания для одного владельца компании."""
+    user_id: int
+    tg_id: int
+    business_id: int
+    business_name: str
+    expenses: int
+    budget: int  # Бюджет после списания
+    paid: bool
+
+
+@connection(write=True)
 async def deduct_all_expenses(session):
-    users = await session.scalars(
-        select(User)
-        .options(selectinload(User.business))  # Явно загружаем связанные данные
-        .where(User.business_id.isnot(None))
-    )
-    total_deducted = 0
-
-    for user in users:
-        business = user.business
-        if business:
-            if business.budget >= business.expenses:
-                business.budget -= business.expenses
-                total_deducted += business.expenses
-                business.cost += total_deducted
-                await log_event(
-                    user_id=user.id,
-                    event_type="deduct_expenses",
-                    description=f"Списаны ежемесячные затраты у бизнеса {business.name} на сумму {business.expenses} рублей.",
-                    business_id=business.id
-                )
-            else:
-                await log_event(
-                    user_id=user.id,
-                    event_type="deduct_expenses_failed",
-                    description=f"У бизнеса {business.name} недостаточно средств для списания ежемесячных затрат. Требуется: {business.expenses}, доступно: {business.budget}.",
-                    business_id=business.id
-                )
-
-    await session.commit()
-    return total_deducted
+    """Списывает ежемесячные затраты у всех компаний с владельцами.
 
+    Выполняется одной транзакцией за фиксированное число запросов
+    (UPDATE, SELECT, пакетный INSERT) независимо от количества компаний.
+    Возвращает общую сумму списания и список ExpenseCharge для уведомлений.
+    """
+    has_owner = select(User.id).where(User.business_id == Business.id).exists()
+    can_pay = and_(has_owner, Business.budget >= Business.expenses)
+    charge = (
+        update(Business)
+        .where(can_pay)
+        .values(budget=Business.budget - Business.expenses, cost=Business.cost + Business.expenses)
+        .execution_options(synchronize_session=False)
+    )
 
-@connection
+    if session.bind.dialect.update_returning:
+        paid_ids = set(await session.scalars(charge.returning(Business.id)))
+    else:
+        paid_ids = set(await session.scalars(select(Business.id).where(can_pay).with_for_update()))
+        if paid_ids:
+            await session.execute(charge.where(Business.id.in_(paid_ids)))
+
+    rows = await session.execute(
+        select(User.id, User.tg_id, Business.id, Business.name, Business.expenses, Business.budget)
+        .join(Business, User.business_id == Business.id)
+        .order_by(User.id)
+    )
+    charges = [
+        ExpenseCharge(user_id, tg_id, business_id, name, expenses, budget, business_id in paid_ids)
+        for user_id, tg_id, business_id, name, expenses, budget in rows
+    ]
+    if not charges:
+        return 0, charges
+
+    # Уведомление получает каждый владелец, а событие пишется одно на компанию
+    # (от имени первого владельца), как и само списание
+    per_business = {}
+    for c in charges:
+        per_business.setdefault(c.business_id, c)
+
+    await session.execute(insert(Event), [
+        {
+            "user_id": c.user_id,
+            "business_id": c.business_id,
+            "event_type": "deduct_expenses",
+            "description": f"Списаны ежемесячные затраты у бизнеса {c.business_name} на сумму {c.expenses} рублей.",
+        } if c.paid else {
+            "user_id": c.user_id,
+            "business_id": c.business_id,
+            "event_type": "deduct_expenses_failed",
+            "description": f"У бизнеса {c.business_name} недостаточно средств для списания ежемесячных затрат. Требуется: {c.expenses}, доступно: {c.budget}.",
+        }
+        for c in per_business.values()
+    ])
+
+    total_deducted = sum(c.expenses for c in per_business.values() if c.paid)
+    return total_deducted, charges
+
+
+@connection(write=True)
 async def update_monthly_expenses(session, business_id, new_expenses):
     """Обновляет ежемесячные затраты для бизнеса."""
     business = await session.scalar(select(Business).where(Business.id == business_id))
@@ -243,45 +564,427 @@ async def update_monthly_expenses(session, business_id, new_expenses):
         raise ValueError(f"Бизнес с ID {business_id} не найден.")
 
     business.expenses = new_expenses
-    await session.commit()
+    await session.flush()
 
 
-@connection
-async def increase_prices_by_15_percent(session):
-    """Увеличивает стоимость всех продуктов на 15%."""
-    items = await session.scalars(select(Item))
-    items_list = items.all()  # Получаем список всех товаров
-    for item in items_list:
-        item.price = int(item.price * 1.15)  # Увеличиваем цену на 15% и округляем до целого числа
-    
-    await session.commit()  # Сохраняем изменения в базе данных
-    return len(items_list)  # Возвращаем количество обновленных продуктов
-
+@connection(write=True)
+async def adjust_prices(session, percent, category_id=None, podcategory_id=None):
+    """Изменяет цены товаров на percent процентов одним UPDATE.
 
+    Можно ограничить изменение категорией или подкатегорией. Каждое изменение
+    записывается в price_history. Возвращает количество товаров, цена
+    которых изменилась.
+    """
+    if percent <= -100:
+        raise ValueError("Цена не может уменьшиться на 100% и более.")
+
+    # Целочисленная арифметика в базисных пунктах: одинаково округляет на всех СУБД
+    factor = round((100 + percent) * 100)
+    new_price = Item.price * factor // 10000
+
+    # Товары, цена которых не изменится (0% или округление дешевых), не трогаем
+    scope = [new_price != Item.price]
+    if podcategory_id is not None:
+        scope.append(Item.podcategory == podcategory_id)
+    elif category_id is not None:
+        scope.append(Item.podcategory.in_(
+            select(Podcategory.id).where(Podcategory.category == category_id)
+        ))
+
+    await session.execute(
+        insert(PriceHistory).from_select(
+            ['item_id', 'old_price', 'new_price', 'changed_at'],
+            select(Item.id, Item.price, new_price, literal(datetime.utcnow())).where(*scope)
+        )
+    )
+    result = await session.execute(
+        update(Item).where(*scope).values(price=new_price)
+        .execution_options(synchronize_session=False)
+    )
+    mark_catalog_changed(session)
+    return result.rowcount
 
 
-@connection
+@connection(write=True)
 async def transfer_money(session, from_business_id, to_business_id, amount):
     """Переводит деньги с одного счета на другой."""
     try:
-        # Начинаем транзакцию
-        async with session.begin():
+        # Точка сохранения: при ошибке откатывается только перевод
+        async with session.begin_nested():
             # Списываем деньги с компании-инициатора
-            from_business = await session.scalar(select(Business).where(Business.id == from_business_id))
-            if not from_business:
-                raise ValueError(f"Бизнес с ID {from_business_id} не найден.")
-            if from_business.budget < amount:
-                raise ValueError(f"Недостаточно средств. Бюджет: {from_business.budget}, требуется: {amount}")
-            from_business.budget -= amount
-            from_business.cost += amount
+            await _withdraw(session, from_business_id, amount)
 
             # Добавляем деньги компании-партнеру
-            to_business = await session.scalar(select(Business).where(Business.id == to_business_id))
-            if not to_business:
+            if not await _deposit(session, to_business_id, amount):
                 raise ValueError(f"Бизнес с ID {to_business_id} не найден.")
-            to_business.budget += amount
-            to_business.income += amount
 
     except SQLAlchemyError as e:
-        await session.rollback()  # Откатываем транзакцию в случае ошибки
-        raise ValueError(f"Ошибка при переводе денег: {e}")
\ No newline at end of file
+        raise ValueError(f"Ошибка при переводе денег: {e}")
+
+
+class CheckoutError(ValueError):
+    """Заказ нельзя оформить (нет бизнеса, курьера или пустая корзина)."""
+
+
+class CheckoutResult(NamedTuple):
+    business_name: str
+    total_price: int
+    total_weight: float
+    delivery_cost: float
+    courier_tg_id: int
+    description: str  # Описание заказа для журнала событий
+
+
+def delivery_cost_for(total_weight):
+    """Стоимость доставки: 1 кг = 500 рублей, каждый следующий +200."""
+    return 500 + 200 * (total_weight - 1) if total_weight > 0 else 0
+
+
+@connection(write=True)
+async def checkout(session, tg_id):
+    """Оформляет заказ из корзины одной транзакцией.
+
+    Блокирует строку покупателя, считает стоимость и вес корзины в SQL,
+    списывает деньги у покупателя, платит курьерской компании за доставку,
+    пишет событие заказа и очищает корзину — фиксированным числом запросов.
+    При любой ошибке все изменения откатываются до точки сохранения.
+    """
+    async with session.begin_nested():
+        buyer = (await session.execute(
+            select(User.id, User.business_id, Business.name)
+            .join(Business, User.business_id == Business.id)
+            .where(User.tg_id == tg_id)
+            .with_for_update()
+        )).first()
+        if buyer is None:
+            raise CheckoutError("Ваш бизнес не зарегистрирован.")
+
+        courier = (await session.execute(
+            select(User.tg_id, Business.id)
+            .join(User, User.business_id == Business.id)
+            .where(Business.type == "курьер")
+            .order_by(Business.id, User.id)
+            .limit(1)
+        )).first()
+        if courier is None:
+            raise CheckoutError("Курьерская компания не найдена.")
+
+        # Строки корзины и итоги по всей корзине одним запросом (оконные суммы)
+        lines = (await session.execute(
+            select(
+                Item.name, Cart.quantity, Item.price, Item.weight,
+                func.sum(Item.price * Cart.quantity).over().label('total_price'),
+                func.sum(Item.weight * Cart.quantity).over().label('total_weight'),
+            )
+            .join(Item, Cart.item_id == Item.id)
+            .where(Cart.user_id == buyer.id)
+            .order_by(Cart.id)
+        )).all()
+        if not lines:
+            raise CheckoutError("Ваша корзина пуста.")
+
+        total_price = lines[0].total_price
+        total_weight = lines[0].total_weight
+        delivery_cost = delivery_cost_for(total_weight)
+
+        await _withdraw(session, buyer.business_id, total_price)
+        await _deposit(session, courier.id, delivery_cost)
+
+        cart_description = "\n".join(
+            f"{line.name} - {line.quantity} шт. по {line.price} руб. (вес: {line.weight} кг)" for line in lines
+        )
+        description = (
+            f"Компания {buyer.name} сделала закупку на сумму {total_price} рублей и доставку на сумму {delivery_cost} рублей.\n"
+            f"Состав заказа:\n{cart_description}"
+        )
+        await session.execute(insert(Event).values(
+            user_id=buyer.id,
+            business_id=buyer.business_id,
+            event_type="make_order",
+            description=description,
+            timestamp=datetime.utcnow(),
+        ))
+        await session.execute(delete(Cart).where(Cart.user_id == buyer.id))
+
+    return CheckoutResult(buyer.name, total_price, total_weight, delivery_cost, courier.tg_id, description)
+
+
+@connection
+async def get_processed_callback(session, key):
+    """Возвращает сохраненный результат операции или None."""
+    return await session.scalar(select(ProcessedCallback.result).where(ProcessedCallback.key == key))
+
+
+@connection(write=True)
+async def save_processed_callback(session, key, result):
+    """Сохраняет результат операции в той же транзакции, что и саму операцию."""
+    session.add(ProcessedCallback(key=key, result=result))
+    await session.flush()
+
+
+@connection(write=True)
+async def purge_processed_callbacks(session, older_than):
+    """Удаляет записи об операциях старше older_than."""
+    await session.execute(delete(ProcessedCallback).where(ProcessedCallback.created_at < older_than))
+
+
+class BroadcastJob(NamedTuple):
+    id: int
+    title: str
+    text: str
+    admin_chat_id: int
+    status_message_id: int
+
+
+class BroadcastTarget(NamedTuple):
+    id: int
+    tg_id: int
+    text: str
+
+
+@connection(write=True)
+async def create_broadcast(session, title, recipients, text=None, admin_chat_id=None):
+    """Ставит рассылку в очередь и возвращает ее id.
+
+    recipients — пары (tg_id, личный текст или None). Рассылка пишется в той
+    же транзакции, что и вызвавшая ее операция, и начнет отправляться после
+    commit.
+    """
+    broadcast = Broadcast(title=title, text=text, admin_chat_id=admin_chat_id)
+    session.add(broadcast)
+    await session.flush()
+    if recipients:
+        await session.execute(insert(BroadcastRecipient), [
+            {"broadcast_id": broadcast.id, "tg_id": tg_id, "text": personal_text}
+            for tg_id, personal_text in recipients
+        ])
+    session.info['broadcast_created'] = True
+    return broadcast.id
+
+
+@connection(write=True)
+async def create_broadcast_to_all(session, title, text, admin_chat_id=None):
+    """Рассылка одного текста всем пользователям; получатели копируются одним INSERT ... SELECT."""
+    broadcast = Broadcast(title=title, text=text, admin_chat_id=admin_chat_id)
+    session.add(broadcast)
+    await session.flush()
+    recipients = select(literal(broadcast.id), User.tg_id).where(User.tg_id.is_not(None)).distinct()
+    await session.execute(
+        insert(BroadcastRecipient).from_select(["broadcast_id", "tg_id"], recipients)
+    )
+    session.info['broadcast_created'] = True
+    return broadcast.id
+
+
+@connection
+async def get_unfinished_broadcasts(session):
+    rows = await session.execute(
+        select(Broadcast.id, Broadcast.title, Broadcast.text, Broadcast.admin_chat_id, Broadcast.status_message_id)
+        .where(Broadcast.status.in_(("pending", "running")))
+        .order_by(Broadcast.id)
+    )
+    return [BroadcastJob(*row) for row in rows]
+
+
+@connection
+async def get_broadcast_counts(session, broadcast_id):
+    """Возвращает {статус: число получателей} для рассылки."""
+    rows = await session.execute(
+        select(BroadcastRecipient.status, func.count())
+        .where(BroadcastRecipient.broadcast_id == broadcast_id)
+        .group_by(BroadcastRecipient.status)
+    )
+    return dict(rows.all())
+
+
+@connection
+async def get_broadcast_targets(session, broadcast_id, after_id=0, limit=200):
+    """Следующая страница неотправленных получателей (keyset по id)."""
+    rows = await session.execute(
+        select(BroadcastRecipient.id, BroadcastRecipient.tg_id, BroadcastRecipient.text)
+        .where(
+            BroadcastRecipient.broadcast_id == broadcast_id,
+            BroadcastRecipient.status == "pending",
+            BroadcastRecipient.id > after_id,
+        )
+        .order_by(BroadcastRecipient.id)
+        .limit(limit)
+    )
+    return [BroadcastTarget(*row) for row in rows]
+
+
+@connection(write=True)
+async def mark_broadcast_targets(session, results):
+    """Сохраняет итоги отправки: список словарей id, status, error."""
+    if results:
+        await session.execute(update(BroadcastRecipient), results)
+
+
+@connection(write=True)
+async def update_broadcast(session, broadcast_id, **values):
+    """Меняет статус рассылки или id сообщения о ее ходе."""
+    if values.get("status") == "done":
+        values["finished_at"] = datetime.utcnow()
+    await session.execute(update(Broadcast).where(Broadcast.id == broadcast_id).values(**values))
+
+
+class OutboxEntry(NamedTuple):
+    id: int
+    chat_id: int
+    text: str
+    reply_markup: str
+    attempts: int
+
+
+@connection(write=True)
+async def enqueue_message(session, chat_id, text, reply_markup=None):
+    """Ставит личное сообщение в outbox; уйдет после commit текущей транзакции."""
+    if chat_id is None:
+        return  # Получателя нет; NULL в outbox означает канал
+    session.add(OutboxMessage(
+        chat_id=chat_id,
+        text=text,
+        reply_markup=reply_markup.model_dump_json(exclude_none=True) if reply_markup else None,
+    ))
+    await session.flush()
+    session.info['outbox_added'] = True
+
+
+HASHTAG = re.compile(r'#\w+')
+
+
+@connection(write=True)
+async def enqueue_channel_post(session, text):
+    """Ставит пост в канал CHANNEL_ID в outbox; первый хэштег поста — его тема."""
+    topic = HASHTAG.search(text)
+    session.add(OutboxMessage(chat_id=None, text=text, topic=topic.group() if topic else None))
+    await session.flush()
+    session.info['outbox_added'] = True
+
+
+def _not_held(urgent_topics):
+    # В режиме сводки посты канала вне срочных тем ждут get_digest_posts
+    if urgent_topics is None:
+        return True
+    return or_(OutboxMessage.chat_id.is_not(None), OutboxMessage.topic.in_(urgent_topics))
+
+
+@connection
+async def get_due_outbox(session, limit=100, urgent_topics=None):
+    """Сообщения, которые пора отправить, в порядке постановки.
+
+    urgent_topics=None — все сообщения; иначе из постов в канал только посты
+    с этими хэштегами, остальные уходят сводкой.
+    """
+    rows = await session.execute(
+        select(OutboxMessage.id, OutboxMessage.chat_id, OutboxMessage.text,
+               OutboxMessage.reply_markup, OutboxMessage.attempts)
+        .where(OutboxMessage.status == "pending", OutboxMessage.next_attempt_at <= datetime.utcnow(),
+               _not_held(urgent_topics))
+        .order_by(OutboxMessage.id)
+        .limit(limit)
+    )
+    return [OutboxEntry(*row) for row in rows]
+
+
+@connection
+async def get_next_outbox_attempt(session, urgent_topics=None):
+    """Время ближайшей отложенной попытки или None (посты для сводки не учитываются)."""
+    return await session.scalar(
+        select(func.min(OutboxMessage.next_attempt_at))
+        .where(OutboxMessage.status == "pending", _not_held(urgent_topics))
+    )
+
+
+class DigestPost(NamedTuple):
+    id: int
+    topic: str
+    text: str
+    attempts: int
+    created_at: datetime
+
+
+@connection
+async def get_digest_posts(session, urgent_topics, limit=500):
+    """Посты в канал, ожидающие сводки, в порядке постановки."""
+    rows = await session.execute(
+        select(OutboxMessage.id, OutboxMessage.topic, OutboxMessage.text,
+               OutboxMessage.attempts, OutboxMessage.created_at)
+        .where(OutboxMessage.status == "pending", OutboxMessage.next_attempt_at <= datetime.utcnow(),
+               OutboxMessage.chat_id.is_(None),
+               or_(OutboxMessage.topic.is_(None), OutboxMessage.topic.not_in(urgent_topics)))
+        .order_by(OutboxMessage.id)
+        .limit(limit)
+    )
+    return [DigestPost(*row) for row in rows]
+
+
+@connection(write=True)
+async def mark_outbox(session, results):
+    """Сохраняет итоги отправки: словари id, status, attempts, next_attempt_at, error, sent_at."""
+    if results:
+        await session.execute(update(OutboxMessage), results)
+
+
+@connection(write=True)
+async def purge_outbox(session, older_than):
+    """Удаляет отправленные сообщения старше older_than."""
+    await session.execute(
+        delete(OutboxMessage).where(OutboxMessage.status == "sent", OutboxMessage.sent_at < older_than)
+    )
+
+
+class FsmRecord(NamedTuple):
+    state: str
+    data: str  # JSON или None
+    updated_at: datetime
+
+
+@connection
+async def get_fsm_record(session, key):
+    """Состояние и данные FSM по ключу или None."""
+    row = (await session.execute(
+        select(FsmState.state, FsmState.data, FsmState.updated_at).where(FsmState.key == key)
+    )).first()
+    return FsmRecord(*row) if row else None
+
+
+@connection
+async def get_fsm_version(session, key):
+    """Время последнего изменения состояния FSM по ключу или None."""
+    return await session.scalar(select(FsmState.updated_at).where(FsmState.key == key))
+
+
+@connection(write=True)
+async def save_fsm_field(session, key, field, value):
+    """Записывает state или data одним upsert; пустая запись удаляется."""
+    invalidate_fsm(session, key)
+    now = datetime.utcnow()
+    dialect_insert = UPSERT_INSERTS.get(session.bind.dialect.name)
+    if dialect_insert is not None:
+        stmt = dialect_insert(FsmState).values(key=key, updated_at=now, **{field: value})
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=[FsmState.key], set_={field: value, 'updated_at': now},
+        ))
+    else:
+        record = await session.get(FsmState, key)
+        if record is None:
+            session.add(FsmState(key=key, updated_at=now, **{field: value}))
+        else:
+            setattr(record, field, value)
+            record.updated_at = now
+        await session.flush()
+
+    if value is None:
+        # Ни состояния, ни данных: строка больше не нужна
+        await session.execute(
+            delete(FsmState).where(FsmState.key == key, FsmState.state.is_(None), FsmState.data.is_(None))
+        )
+
+
+@connection(write=True)
+async def purge_fsm_batch(session, older_than, batch_size=1000):
+    """Удаляет до batch_size состояний FSM, не менявшихся с older_than. Возвращает число удаленных."""
+    keys = select(FsmState.key).where(FsmState.updated_at < older_than).limit(batch_size)
+    result = await session.execute(delete(FsmState).where(FsmState.key.in_(keys.scalar_subquery())))
+    return result.rowcount
@@ -0,0 +1,157 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import select, delete
+
+from app.database.models import async_session, Event, EventRollup
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ARCHIVE_DIR = 'archive/events'
+ARCHIVE_BATCH_SIZE = 5000
+
+
+def get_archive_dir():
+    """Каталог архива из EVENT_ARCHIVE_DIR.
+
+    Читается при вызове, а не при импорте: модуль импортируется раньше,
+    чем загружен .env.
+    """
+    load_dotenv()
+    return os.getenv('EVENT_ARCHIVE_DIR', DEFAULT_ARCHIVE_DIR)
+
+
+def _archive_path(archive_dir, moment):
+    return os.path.join(archive_dir, f"events-{moment:%Y-%m}.jsonl.gz")
+
+
+def _append_to_archive(archive_dir, rows):
+    """Дописывает события в сжатые JSONL-файлы архива (по файлу на месяц).
+
+    Каждый вызов добавляет в файл новый gzip-member, поэтому файлы только
+    растут и ранее записанные данные не переписываются.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    by_file = {}
+    for row in rows:
+        by_file.setdefault(_archive_path(archive_dir, row['timestamp']), []).append(row)
+
+    for path, file_rows in by_file.items():
+        lines = ''.join(
+            json.dumps({**row, 'timestamp': row['timestamp'].isoformat()}, ensure_ascii=False) + '\n'
+            for row in file_rows
+        )
+        with open(path, 'ab') as file:
+            file.write(gzip.compress(lines.encode('utf-8')))
+            file.flush()
+            os.fsync(file.fileno())
+
+
+async def _merge_rollups(session, rows):
+    counts = Counter((row['business_id'], row['event_type'], row['timestamp'].date()) for row in rows)
+    existing = await session.scalars(
+        select(EventRollup).where(EventRollup.day.in_({day for _, _, day in counts}))
+    )
+    for rollup in existing:
+        key = (rollup.business_id, rollup.event_type, rollup.day)
+        if key in counts:
+            rollup.count += counts.pop(key)
+    session.add_all(
+        EventRollup(business_id=business_id, event_type=event_type, day=day, count=count)
+        for (business_id, event_type, day), count in counts.items()
+    )
+
+
+async def archive_events(older_than_days=90, archive_dir=None, batch_size=ARCHIVE_BATCH_SIZE):
+    """Переносит события старше older_than_days из таблицы events в архив.
+
+    Для каждой пачки: события дописываются в архив на диске, затем одной
+    транзакцией обновляются дневные свертки и пачка удаляется из events.
+    Если процесс упадет между записью файла и commit, при повторном запуске
+    пачка попадет в архив второй раз (в архиве возможны дубли по id).
+    Возвращает количество перенесенных событий. archive_dir=None — каталог
+    из get_archive_dir.
+    """
+    archive_dir = archive_dir or get_archive_dir()
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    archived = 0
+    while True:
+        async with async_session() as session:
+            result = await session.execute(
+                select(Event.id, Event.user_id, Event.business_id, Event.event_type,
+                       Event.description, Event.timestamp)
+                .where(Event.timestamp < cutoff)
+                .order_by(Event.id)
+                .limit(batch_size)
+            )
+            rows = [row._asdict() for row in result]
+            if not rows:
+                return archived
+
+            await asyncio.to_thread(_append_to_archive, archive_dir, rows)
+            await _merge_rollups(session, rows)
+            # Пачка — это все старые события с id не больше последнего
+            await session.execute(
+                delete(Event).where(Event.id <= rows[-1]['id'], Event.timestamp < cutoff)
+            )
+            await session.commit()
+        archived += len(rows)
+
+
+def iter_archived_events(archive_dir=None, since=None, until=None, business_id=None):
+    """Потоково читает события из архива (для аудита), не загружая файлы целиком."""
+    archive_dir = archive_dir or get_archive_dir()
+    if not os.path.isdir(archive_dir):
+        return
+    for name in sorted(os.listdir(archive_dir)):
+        if not name.endswith('.jsonl.gz'):
+            continue
+        with gzip.open(os.path.join(archive_dir, name), 'rt', encoding='utf-8') as file:
+            for line in file:
+                event = json.loads(line)
+                timestamp = datetime.fromisoformat(event['timestamp'])
+                if since and timestamp < since or until and timestamp >= until:
+                    continue
+                if business_id is not None and event['business_id'] != business_id:
+                    continue
+                event['timestamp'] = timestamp
+                yield event
+
+
+class RetentionJob:
+    """Периодически переносит старые события в архив."""
+    def __init__(self, older_than_days, interval=6 * 60 * 60, archive_dir=None):
+        self.older_than_days = older_than_days
+        self.interval = interval
+        self.archive_dir = archive_dir
+        self._task = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name='event-retention')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                archived = await archive_events(self.older_than_days, self.archive_dir)
+                if archived:
+                    logger.info('В архив перенесено %s событий', archived)
+            except Exception:
+                logger.exception('Ошибка при архивации событий')
+            await asyncio.sleep(self.interval)
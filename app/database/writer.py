@@ -0,0 +1,119 @@
+import asyncio
+import logging
+
+from app.database.models import async_session
+
+
+logger = logging.getLogger(__name__)
+
+
+class WriteQueue:
+    """Единственный писатель в базу (для SQLite).
+
+    Функции записи из app.database.requests не открывают свою транзакцию,
+    а ставят операцию в очередь. Фоновая задача забирает все накопившиеся
+    операции, выполняет их по очереди в одной транзакции — каждую в своей
+    точке сохранения — и делает один commit на всю пачку. Ошибка операции
+    откатывает только ее точку сохранения и возвращается вызвавшему; успешный
+    результат возвращается после commit. Чтение идет мимо очереди.
+    """
+    def __init__(self, max_batch=200, max_queue=10_000):
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self._queue = None
+        self._task = None
+        self.submitted = 0
+        self.committed = 0
+        self.failed = 0
+        self.batches = 0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run(), name='db-writer')
+
+    async def stop(self):
+        """Останавливает писателя, выполнив все операции, стоящие в очереди."""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, func, *args, **kwargs):
+        """Выполняет func(session, *args, **kwargs) в транзакции писателя."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((future, func, args, kwargs))
+        self.submitted += 1
+        return await future
+
+    async def _run(self):
+        while True:
+            op = await self._queue.get()
+            if op is None:
+                return
+            # Пока шел прошлый commit, очередь набрала следующие операции
+            batch = [op]
+            stopping = False
+            while len(batch) < self.max_batch and not self._queue.empty():
+                op = self._queue.get_nowait()
+                if op is None:
+                    stopping = True
+                    break
+                batch.append(op)
+
+            await self._execute(batch)
+            if stopping:
+                return
+
+    async def _execute(self, batch):
+        outcomes = []
+        try:
+            async with async_session() as session:
+                # Блокировку записи берем сразу, а не при первом UPDATE
+                await session.connection(execution_options={'sqlite_begin': 'IMMEDIATE'})
+                for future, func, args, kwargs in batch:
+                    if future.done():  # Вызвавший уже отменил ожидание
+                        continue
+                    try:
+                        async with session.begin_nested():
+                            outcomes.append((future, True, await func(session, *args, **kwargs)))
+                    except Exception as e:
+                        outcomes.append((future, False, e))
+                await session.commit()
+        except Exception as e:
+            logger.exception('Не удалось записать пачку из %s операций', len(batch))
+            self.failed += len(batch)
+            for future, *_ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        for future, ok, value in outcomes:
+            if future.done():
+                continue
+            if ok:
+                self.committed += 1
+                future.set_result(value)
+            else:
+                self.failed += 1
+                future.set_exception(value)
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'depth': self._queue.qsize() if self._queue else 0,
+            'submitted': self.submitted,
+            'committed': self.committed,
+            'failed': self.failed,
+            'batches': self.batches,
+        }
+
+
+write_queue = WriteQueue()
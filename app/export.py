@@ -0,0 +1,73 @@
+import asyncio
+import csv
+import os
+from datetime import datetime
+
+from sqlalchemy import select
+
+from app.database.models import async_session, Business, Cart, Item, Event
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # XLSX — необязательная зависимость
+    Workbook = None
+
+
+# Сколько строк читается из базы и пишется в файл за раз
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_QUERIES = {
+    'businesses': select(
+        Business.id, Business.type, Business.name, Business.budget,
+        Business.income, Business.cost, Business.expenses,
+    ).order_by(Business.id),
+    'carts': select(
+        Cart.id, Cart.user_id, Cart.item_id, Item.name.label('item_name'),
+        Item.price, Cart.quantity,
+    ).join(Item, Cart.item_id == Item.id).order_by(Cart.id),
+    'events': select(
+        Event.id, Event.timestamp, Event.user_id, Event.business_id,
+        Event.event_type, Event.description,
+    ).order_by(Event.id),
+}
+
+
+async def _stream_rows(stmt):
+    """Отдает строки пачками, не загружая таблицу в память целиком."""
+    async with async_session() as session:
+        result = await session.stream(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for partition in result.partitions(EXPORT_BATCH_SIZE):
+            yield partition
+
+
+async def export_csv(directory):
+    """Пишет каждую таблицу в отдельный CSV-файл. Возвращает пути к файлам."""
+    paths = []
+    for name, stmt in EXPORT_QUERIES.items():
+        path = os.path.join(directory, f"{name}.csv")
+        with open(path, 'w', newline='', encoding='utf-8-sig') as file:  # BOM — для Excel
+            writer = csv.writer(file)
+            writer.writerow(stmt.selected_columns.keys())
+            async for rows in _stream_rows(stmt):
+                # Запись пачки — в потоке, чтобы не блокировать обработку апдейтов
+                await asyncio.to_thread(writer.writerows, rows)
+        paths.append(path)
+    return paths
+
+
+async def export_xlsx(directory):
+    """Пишет все таблицы на отдельные листы одного XLSX-файла (режим write_only)."""
+    workbook = Workbook(write_only=True)
+    for name, stmt in EXPORT_QUERIES.items():
+        sheet = workbook.create_sheet(name)
+        sheet.append(list(stmt.selected_columns.keys()))
+        async for rows in _stream_rows(stmt):
+            await asyncio.to_thread(_append_rows, sheet, rows)
+    path = os.path.join(directory, f"export_{datetime.utcnow():%Y%m%d_%H%M%S}.xlsx")
+    await asyncio.to_thread(workbook.save, path)
+    return [path]
+
+
+def _append_rows(sheet, rows):
+    for row in rows:
+        sheet.append(list(row))
@@ -8,6 +8,7 @@ from dotenv import load_dotenv
 import os
 
 import app.keyboards as kb
+from app.database.catalog import catalog
 
 
 import app.database.requests as rq
@@ -35,23 +36,17 @@ class Contract(StatesGroup):
 
 load_dotenv()
 
-async def send_message_to_channel(bot: Bot, text: str):
-    """Отправляет сообщение в канал."""
-    await bot.send_message(chat_id=os.getenv('CHANNEL_ID'), text=text)
-
-
-
 @router.message(Command("start"))
 async def cmd_start(message: Message, state: FSMContext):
     """Обрабатывает команду /start и выводит список бизнесов."""
-    businesses = await rq.get_all_businesses()
-    if not businesses:
+    page = await rq.get_businesses_page()
+    if not page.rows:
         await message.answer("Нет доступных бизнесов. Обратитесь к администратору.")
         return
 
     await message.answer(
         "Выберите тип вашего бизнеса:",
-        reply_markup=kb.business_keyboard(businesses)
+        reply_markup=kb.business_keyboard(page)
     )
 
 
@@ -82,21 +77,18 @@ async def rename_business(message: Message, state: FSMContext):
     # Изменяем название бизнеса
     await rq.rename_business(business_id, business_name)
 
-    user = await rq.get_user_by_tg_id(message.from_user.id)
+    user = await rq.get_identity(message.from_user.id)
 
     # Логируем событие
     await rq.log_event(
-        user_id=user.id,
+        user_id=user.user_id,
         event_type="rename_business",
         description=f"Появилась новая компания: {business_name}",
         business_id=business_id
     )
 
-    # Отправляем сообщение в канал
-    await send_message_to_channel(
-        bot=message.bot,
-        text=f"Появилась новая компания: {business_name} \n#новая_компания"
-    )
+    # Пост в канал уйдет через outbox после commit
+    await rq.enqueue_channel_post(f"Появилась новая компания: {business_name} \n#новая_компания")
 
     await message.answer(f"Название вашего бизнеса успешно изменено на: {business_name}! \nЧтобы узнать о своей компании используйте компанду /my_business")
     await state.clear()
@@ -105,25 +97,30 @@ async def rename_business(message: Message, state: FSMContext):
 
 @router.callback_query(F.data.startswith("page_"))
 async def paginate(callback: CallbackQuery):
-    """Универсальный обработчик перелистывания страниц."""
+    """Универсальный обработчик перелистывания страниц.
+
+    Форматы callback_data:
+    page_business_<n|p>_<id> и page_items_<podcategory_id>_<n|p>_<id>,
+    где n — страница после id, p — страница перед id.
+    """
     data = callback.data.split("_")
     page_type = data[1]  # Определяем тип (business или items)
-    page = int(data[2])  # Определяем номер страницы
+    direction, cursor = data[-2], int(data[-1])
+    cursor_kwargs = {"after_id": cursor} if direction == "n" else {"before_id": cursor}
 
     if page_type == "business":
-        # Получаем бизнесы для данной страницы
-        businesses = await rq.get_all_businesses()
+        # Получаем только бизнесы нужной страницы
+        page = await rq.get_businesses_page(**cursor_kwargs)
         await callback.message.edit_text(
             "Выберите бизнес:",
-            reply_markup=kb.business_keyboard(businesses, page=page)
+            reply_markup=kb.business_keyboard(page)
         )
 
     elif page_type == "items":
-        # Получаем товары для данной категории
-        category_id = int(callback.message.reply_markup.inline_keyboard[0][0].callback_data.split("_")[1])  # Категория берётся из текущей клавиатуры
+        podcategory_id = int(data[2])
         await callback.message.edit_text(
             "Выберите товар:",
-            reply_markup=await kb.items(category_id, page=page)
+            reply_markup=await kb.items(podcategory_id, **cursor_kwargs)
         )
 
 
@@ -131,17 +128,17 @@ async def paginate(callback: CallbackQuery):
 @router.message(Command("my_business") or F.data == "to_main")
 async def show_business_info(message: Message):
     """Показывает информацию о бизнесе пользователя."""
-    user_data = await rq.get_user_with_business(message.from_user.id)
-    if not user_data or not user_data.business_id:
+    identity = await rq.get_identity(message.from_user.id)
+    if not identity or not identity.business_id:
         await message.answer("Вы ещё не зарегистрировали бизнес. Пожалуйста, начните с команды /start.")
         return
 
-    business = user_data.business
+    card = await rq.get_balance_card(identity.business_id)
     response = (
-        f"Тип вашего бизнес: {business.type}\n"
-        f"Название вашего бизнеса: {business.name}\n"
-        f"Текущий бюджет: {business.budget} рублей\n"
-        f"Текущие ежемесячные траты: {business.expenses} рублей"
+        f"Тип вашего бизнес: {card.type}\n"
+        f"Название вашего бизнеса: {card.name}\n"
+        f"Текущий бюджет: {card.budget} рублей\n"
+        f"Текущие ежемесячные траты: {card.expenses} рублей"
     )
     await message.answer(response, reply_markup=kb.user_command())
 
@@ -157,7 +154,7 @@ async def catalog_gen_post(callback: CallbackQuery):
 @router.callback_query(F.data.startswith('category_'))
 async def category(callback: CallbackQuery):
     category_id = int(callback.data.split('_')[1])
-    podcategories = await rq.get_podcategories(category_id)
+    podcategories = await catalog.podcategories(category_id)
     if not podcategories:
         await callback.message.answer('Нет подкатегорий для этой категории')
         return
@@ -221,9 +218,9 @@ async def set_quantity(message: Message, state: FSMContext):
     item_id = data.get("selected_item_id")
 
     # Добавляем товар в корзину
-    user = await rq.get_user_by_tg_id(message.from_user.id)
+    user = await rq.get_identity(message.from_user.id)
 
-    await rq.add_to_cart(user.id, item_id, quantity)
+    await rq.add_to_cart(user.user_id, item_id, quantity)
 
     await message.answer(
         "Товар добавлен в корзину!",
@@ -235,17 +232,17 @@ async def set_quantity(message: Message, state: FSMContext):
 @router.callback_query(F.data == "to_main")
 async def to_main(callback: CallbackQuery):
     """Обрабатывает кнопку 'На главную'."""
-    user_data = await rq.get_user_with_business(callback.from_user.id)
-    if not user_data or not user_data.business_id:
+    identity = await rq.get_identity(callback.from_user.id)
+    if not identity or not identity.business_id:
         await callback.message.answer("Вы ещё не зарегистрировали бизнес. Пожалуйста, начните с команды /start.")
         return
 
-    business = user_data.business
+    card = await rq.get_balance_card(identity.business_id)
     response = (
-        f"Тип вашего бизнеса: {business.type}\n"
-        f"Название вашего бизнеса: {business.name}\n"
-        f"Текущий бюджет: {business.budget} рублей\n"
-        f"Текущие ежемесячные траты: {business.expenses} рублей"
+        f"Тип вашего бизнеса: {card.type}\n"
+        f"Название вашего бизнеса: {card.name}\n"
+        f"Текущий бюджет: {card.budget} рублей\n"
+        f"Текущие ежемесячные траты: {card.expenses} рублей"
     )
     await callback.message.answer(response, reply_markup=kb.user_command())
 
@@ -253,8 +250,8 @@ async def to_main(callback: CallbackQuery):
 @router.callback_query(F.data == "show_cart")
 async def show_cart(callback: CallbackQuery):
     """Отображает содержимое корзины."""
-    user = await rq.get_user_by_tg_id(callback.from_user.id)
-    cart_items = await rq.get_cart(user.id)
+    user = await rq.get_identity(callback.from_user.id)
+    cart_items = await rq.get_cart(user.user_id)
     if not cart_items:
         await callback.message.answer("Ваша корзина пуста.")
         return
@@ -270,93 +267,39 @@ async def show_cart(callback: CallbackQuery):
     await callback.message.answer(response, reply_markup=kb.confirm_order_keyboard())
 
 
-@router.callback_query(F.data == "confirm_order")
+@router.callback_query(F.data == "confirm_order", flags={"idempotent": True})
 async def confirm_order(callback: CallbackQuery):
-    user = await rq.get_user_with_business(callback.from_user.id)
-    if not user or not user.business:
-        await callback.answer("Ваш бизнес не зарегистрирован.")
-        return
-
-    # Находим владельца курьерской компании
-    courier_owner = await rq.get_courier_business_owner()
-    if not courier_owner:
-        await callback.message.answer("Курьерская компания не найдена.")
-        return
-
-    user = await rq.get_user_by_tg_id(callback.from_user.id)
-    cart_items = await rq.get_cart(user.id)
-
-    if not cart_items:
-        await callback.message.answer("Ваша корзина пуста.")
-        return
-
-    # Подсчитываем итоговую стоимость заказа и общий вес
-    total_price = 0
-    total_weight = 0.0  # Теперь total_weight будет float
-    cart_details = []  # Список для хранения информации о каждом товаре в корзине
-
-    for item, quantity in cart_items:
-        total_price += item.price * quantity
-        total_weight += item.weight * quantity
-        cart_details.append(f"{item.name} - {quantity} шт. по {item.price} руб. (вес: {item.weight} кг)")
-
-    # Рассчитываем стоимость доставки
-    delivery_cost = 500 + 200 * (total_weight - 1) if total_weight > 0 else 0  # 1 кг = 500 рублей, каждый следующий +200
-
-    # Проверяем, хватает ли бюджета для оформления заказа
-    if user.business.budget < total_price:
+    # Списание, оплата доставки, журнал и очистка корзины — одной транзакцией
+    try:
+        order = await rq.checkout(callback.from_user.id)
+    except rq.InsufficientFundsError:
         await callback.message.answer("Недостаточно средств на счете для оформления заказа.")
         return
+    except rq.CheckoutError as e:
+        await callback.message.answer(str(e))
+        return
 
-    # Списываем деньги с бюджета и логируем событие
-    await rq.deduct_money_from_business(user.business_id, total_price)
-
-    # Формируем описание заказа для лога
-    cart_description = "\n".join(cart_details)
-    log_description = (
-        f"Компания {user.business.name} сделала закупку на сумму {total_price} рублей и доставку на сумму {delivery_cost} рублей.\n"
-        f"Состав заказа:\n{cart_description}"
+    # Сообщение владельцу курьерской компании и пост в канал — через outbox
+    await rq.enqueue_message(
+        order.courier_tg_id,
+        f"У вас новая доставка для компании {order.business_name} на сумму {order.delivery_cost} рублей, весом {order.total_weight} кг."
     )
-
-    # Логируем событие
-    await rq.log_event(
-        user_id=user.id,
-        event_type="make_order",
-        description=log_description,
-        business_id=user.business_id
+    await rq.enqueue_channel_post(
+        f"Компания {order.business_name} сделала закупку на сумму {order.total_price} рублей \n#закупки"
     )
 
-    await rq.add_money_to_company(courier_owner.business_id, delivery_cost)
-
-    # Отправляем сообщение владельцу курьерской компании
-    try:
-        await callback.bot.send_message(
-            chat_id=courier_owner.tg_id,  # Отправляем сообщение напрямую пользователю
-            text=f"У вас новая доставка для компании {user.business.name} на сумму {delivery_cost} рублей, весом {total_weight} кг."
-        )
-    except Exception as e:
-        pass
-
-    # Очищаем корзину
-    await rq.clear_cart(user.id)
-
     # Подтверждаем заказ пользователю
     await callback.message.answer(f"Заказ оформлен! Спасибо за покупку.")
-
-    # Отправляем сообщение в канал
-    await send_message_to_channel(
-        bot=callback.bot,
-        text=f"Компания {user.business.name} сделала закупку на сумму {total_price} рублей \n#закупки"
-    )
+    return f"заказ на сумму {order.total_price} рублей оформлен"
 
 
 @router.callback_query(F.data == "cancel_order")
 async def cancel_order(callback: CallbackQuery):
     """Обрабатывает отмену заказа и очищает корзину."""
-    user = await rq.get_user_with_business(callback.from_user.id)
+    user = await rq.get_identity(callback.from_user.id)
 
     # Очищаем корзину пользователя
-    await rq.clear_cart(user.id)
+    await rq.clear_cart(user.user_id)
 
     # Уведомляем пользователя
     await callback.message.answer("Ваш заказ отменён. Все товары удалены из корзины.")
@@ -382,26 +325,26 @@ async def process_payroll_tax(message: Message, state: FSMContext):
     data = await state.get_data()
     income_tax = data['income_tax']
     
-    user = await rq.get_user_with_business(message.from_user.id)
-    if user and user.business:
+    user = await rq.get_identity(message.from_user.id)
+    if user and user.business_id:
         total_tax = income_tax + payroll_tax
-        if user.business.budget >= total_tax:
-            await rq.deduct_money_from_business(user.business.id, total_tax)
+        try:
+            await rq.deduct_money_from_business(user.business_id, total_tax)
+        except rq.InsufficientFundsError:
+            await message.answer("Недостаточно средств на счете.")
+        else:
             await message.answer(f"Вы успешно заплатили налог на сумму {total_tax} рублей.")
             ##Отправляем сообщение в канал
-            await send_message_to_channel(
-                bot=message.bot,
-                text=f"Компания {user.business.name} заплатила налоги на сумму {total_tax} рублей \n#налоги"
+            await rq.enqueue_channel_post(
+                f"Компания {user.business_name} заплатила налоги на сумму {total_tax} рублей \n#налоги"
                 )
                 # Логируем событие
             await rq.log_event(
-                user_id=user.id,
+                user_id=user.user_id,
                 event_type="tax",
-                description=f"Компания {user.business.name} заплатила налоги на сумму {total_tax} рублей",
-                business_id=user.business.id
+                description=f"Компания {user.business_name} заплатила налоги на сумму {total_tax} рублей",
+                business_id=user.business_id
                 )
-        else:
-            await message.answer("Недостаточно средств на счете.")
     else:
         await message.answer("Бизнес не найден.")
     
@@ -418,25 +361,25 @@ async def start_insurance_payment(callback: CallbackQuery, state: FSMContext):
 async def process_insurance_amount(message: Message, state: FSMContext):
     insurance_amount = int(message.text)
     
-    user = await rq.get_user_with_business(message.from_user.id)
-    if user and user.business:
-        if user.business.budget >= insurance_amount:
-            await rq.deduct_money_from_business(user.business.id, insurance_amount)
+    user = await rq.get_identity(message.from_user.id)
+    if user and user.business_id:
+        try:
+            await rq.deduct_money_from_business(user.business_id, insurance_amount)
+        except rq.InsufficientFundsError:
+            await message.answer("Недостаточно средств на счете.")
+        else:
             await message.answer(f"Сумма {insurance_amount} успешно переведена.")
             ##Отправляем сообщение в канал
-            await send_message_to_channel(
-                bot=message.bot,
-                text=f"Компания {user.business.name} заплатила страховой компании за страховку {insurance_amount} рублей \n#страховка"
+            await rq.enqueue_channel_post(
+                f"Компания {user.business_name} заплатила страховой компании за страховку {insurance_amount} рублей \n#страховка"
                 )
                         # Логируем событие
             await rq.log_event(
-                user_id=user.id,
+                user_id=user.user_id,
                 event_type="insurance",
-                description=f"Компания {user.business.name}  заплатила страховой компании за страховку {insurance_amount} рублей",
-                business_id=user.business.id
+                description=f"Компания {user.business_name}  заплатила страховой компании за страховку {insurance_amount} рублей",
+                business_id=user.business_id
                 )
-        else:
-            await message.answer("Недостаточно средств на счете.")
     else:
         await message.answer("Бизнес не найден.")
     
@@ -446,14 +389,14 @@ async def process_insurance_amount(message: Message, state: FSMContext):
 @router.callback_query(F.data == "make_contract")
 async def start_contract(callback: CallbackQuery, state: FSMContext):
     """Начинает процесс заключения договора."""
-    businesses = await rq.get_all_businesses()
-    if not businesses:
+    page = await rq.get_businesses_page()
+    if not page.rows:
         await callback.message.answer("Нет доступных компаний для заключения договора.")
         return
 
     await callback.message.answer(
         "Выберите компанию, с которой хотите заключить договор:",
-        reply_markup=kb.business_keyboard(businesses)
+        reply_markup=kb.business_keyboard(page)
     )
     await state.set_state(Contract.awaiting_partner_company)
 
@@ -489,7 +432,7 @@ async def set_contract_amount(message: Message, state: FSMContext):
     description = data.get("contract_description")
 
     # Получаем информацию о компании-партнере
-    partner_business = await rq.get_business_by_id(partner_business_id)
+    partner_business = await rq.get_business_contact(partner_business_id)
     if not partner_business:
         await message.answer("Компания-партнер не найдена.")
         await state.clear()
@@ -509,7 +452,7 @@ async def set_contract_amount(message: Message, state: FSMContext):
     await state.set_state(Contract.awaiting_confirmation)
 
 @router.callback_query(StateFilter(Contract.awaiting_confirmation), F.data == "confirm_contract")
-async def confirm_contract(callback: CallbackQuery, state: FSMContext, bot: Bot):
+async def confirm_contract(callback: CallbackQuery, state: FSMContext):
     """Обрабатывает подтверждение договора."""
     data = await state.get_data()
     partner_business_id = data.get("partner_business_id")
@@ -517,99 +460,105 @@ async def confirm_contract(callback: CallbackQuery, state: FSMContext, bot: Bot)
     amount = data.get("contract_amount")
 
     # Получаем информацию о компании-партнере
-    partner_business = await rq.get_business_by_id(partner_business_id)
+    partner_business = await rq.get_business_contact(partner_business_id)
     if not partner_business:
         await callback.message.answer("Компания-партнер не найдена.")
         await state.clear()
         return
 
     # Получаем информацию о текущем пользователе
-    user = await rq.get_user_with_business(callback.from_user.id)
-    if not user or not user.business:
+    user = await rq.get_identity(callback.from_user.id)
+    if not user or not user.business_id:
         await callback.message.answer("Ваш бизнес не зарегистрирован.")
         await state.clear()
         return
 
     # Проверяем, хватает ли средств у инициатора сделки
-    if user.business.budget < amount:
+    balance = await rq.get_balance(user.business_id)
+    if balance.budget < amount:
         await callback.message.answer("Недостаточно средств на счете для заключения договора.")
         await state.clear()
         return
 
+    if not partner_business.owner_tg_id:
+        await callback.message.answer("У компании-партнера нет владельца.")
+        await state.clear()
+        return
+
     # Отправляем запрос на подтверждение сделки компании-партнеру
-    await bot.send_message(
-        chat_id=partner_business.users[0].tg_id,  # Предполагаем, что у бизнеса есть хотя бы один владелец
-        text=f"Компания {user.business.name} хочет заключить с вами договор:\n"
-             f"Описание: {description}\n"
-             f"Сумма: {amount} рублей.\n\n"
-             "Подтвердите сделку:",
-        reply_markup=kb.confirm_partner_contract_keyboard(user.business.id, amount)
+    await rq.enqueue_message(
+        partner_business.owner_tg_id,
+        f"Компания {user.business_name} хочет заключить с вами договор:\n"
+        f"Описание: {description}\n"
+        f"Сумма: {amount} рублей.\n\n"
+        "Подтвердите сделку:",
+        reply_markup=kb.confirm_partner_contract_keyboard(user.business_id, amount)
     )
 
     await callback.message.answer("Запрос на заключение договора отправлен. Ожидайте подтверждения.")
     await state.clear()
 
-@router.callback_query(F.data.startswith("confirm_partner_contract_"))
-async def confirm_partner_contract(callback: CallbackQuery, bot: Bot):
+@router.callback_query(F.data.startswith("confirm_partner_contract_"), flags={"idempotent": True})
+async def confirm_partner_contract(callback: CallbackQuery):
     """Обрабатывает подтверждение договора со стороны компании-партнера."""
     data = callback.data.split("_")
     initiator_business_id = int(data[3])
     amount = int(data[4])
 
      # Получаем информацию о компании-инициаторе
-    initiator_business = await rq.get_business_by_id(initiator_business_id)
+    initiator_business = await rq.get_business_contact(initiator_business_id)
     if not initiator_business:
         await callback.message.answer("Компания-инициатор не найдена.")
         return
     
        # Получаем информацию о текущем пользователе (компании-партнере)
-    partner_user = await rq.get_user_with_business(callback.from_user.id)
-    if not partner_user or not partner_user.business:
+    partner_user = await rq.get_identity(callback.from_user.id)
+    if not partner_user or not partner_user.business_id:
         await callback.message.answer("Ваш бизнес не зарегистрирован.")
         return
     try:
         # Переводим деньги
-        await rq.transfer_money(initiator_business_id, partner_user.business.id, amount)
+        await rq.transfer_money(initiator_business_id, partner_user.business_id, amount)
 
         # Уведомляем обе стороны
-        await bot.send_message(
-            chat_id=initiator_business.users[0].tg_id,
-            text=f"Компания {partner_user.business.name} подтвердила договор. Сумма {amount} рублей переведена."
+        await rq.enqueue_message(
+            initiator_business.owner_tg_id,
+            f"Компания {partner_user.business_name} подтвердила договор. Сумма {amount} рублей переведена."
         )
         await callback.message.answer(f"Вы подтвердили договор с компанией {initiator_business.name}. Сумма {amount} рублей зачислена на ваш счет.")
         ##Отправляем сообщение в канал
-        await send_message_to_channel(
-            bot=callback.bot,
-            text=f"Компания {initiator_business.name} заключила договор с компанией {partner_user.business.name} на сумму {amount} рублей \n #договор"
+        await rq.enqueue_channel_post(
+            f"Компания {initiator_business.name} заключила договор с компанией {partner_user.business_name} на сумму {amount} рублей \n #договор"
             )
         # Логируем событие
         await rq.log_event(
-            user_id=initiator_business.users[0].id,
+            user_id=initiator_business.owner_user_id,
             event_type="contract",
-            description=f"Компания {initiator_business.name} заключила договор с компанией {partner_user.business.name} на сумму {amount} рублей ",
+            description=f"Компания {initiator_business.name} заключила договор с компанией {partner_user.business_name} на сумму {amount} рублей ",
             business_id=initiator_business.id
-            )    
+            )
+        return f"договор с компанией {initiator_business.name} на сумму {amount} рублей подтвержден"
 
     except ValueError as e:
         await callback.message.answer(f"Ошибка: {e}")
 
 
 @router.callback_query(F.data.startswith("reject_partner_contract_"))
-async def reject_partner_contract(callback: CallbackQuery, bot: Bot):
+async def reject_partner_contract(callback: CallbackQuery):
     """Обрабатывает отказ от договора со стороны компании-партнера."""
     data = callback.data.split("_")
     initiator_business_id = int(data[3])
 
     # Получаем информацию о компании-инициаторе
-    initiator_business = await rq.get_business_by_id(initiator_business_id)
+    initiator_business = await rq.get_business_contact(initiator_business_id)
     if not initiator_business:
         await callback.message.answer("Компания-инициатор не найдена.")
         return
 
     # Уведомляем обе стороны об отмене сделки
-    await bot.send_message(
-        chat_id=initiator_business.users[0].tg_id,
-        text=f"Директор {callback.from_user.full_name} отклонил(а) ваш договор."
+    await rq.enqueue_message(
+        initiator_business.owner_tg_id,
+        f"Директор {callback.from_user.full_name} отклонил(а) ваш договор."
     )
 
     await callback.message.answer("Вы отклонили договор.")
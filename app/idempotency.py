@@ -0,0 +1,166 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import app.database.requests as rq
+from app.database.writer import write_queue
+
+
+class TTLStore:
+    """Ограниченный по размеру словарь с временем жизни записей (LRU-вытеснение)."""
+    def __init__(self, max_size=10_000, ttl=24 * 60 * 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class IdempotencyMiddleware(BaseMiddleware):
+    """Не дает выполнить операцию по кнопке дважды.
+
+    Применяется к обработчикам с флагом idempotent. Ключ — чат, сообщение и
+    callback_data: повторное нажатие той же кнопки и повторная доставка апдейта
+    после перезапуска дают один и тот же ключ (id callback-запроса у двойного
+    нажатия разный, поэтому в ключ он не входит). Результат хранится в памяти
+    (TTL) и в таблице processed_callbacks, запись в которую идет в той же
+    транзакции, что и сама операция. Дубликат получает сохраненный ответ.
+
+    Обработчик возвращает текст результата при успехе; если вернул None
+    (например, не хватило денег), операция не считается выполненной.
+
+    Внутри апдейта результат попадает в память и ключ освобождается только
+    после commit сессии апдейта (после rollback — только освобождается):
+    иначе при неудачном commit повторное нажатие получило бы "Уже выполнено"
+    за невыполненную операцию, а параллельный дубль не увидел бы запись.
+    """
+    # Как часто чистить устаревшие записи в таблице
+    PURGE_EVERY = 500
+
+    def __init__(self, store=None, durable_ttl=timedelta(days=2)):
+        self.store = store or TTLStore()
+        self.durable_ttl = durable_ttl
+        self._in_flight = {}
+        self._recorded = 0
+        self.duplicates = 0
+
+    @staticmethod
+    def make_key(callback: CallbackQuery):
+        message = callback.message
+        if message is None:
+            return f"inline:{callback.inline_message_id}:{callback.data}"
+        return f"{message.chat.id}:{message.message_id}:{callback.data}"
+
+    async def __call__(
+        self,
+        handler: Callable[[CallbackQuery, Dict[str, Any]], Awaitable[Any]],
+        event: CallbackQuery,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not get_flag(data, "idempotent"):
+            return await handler(event, data)
+
+        key = self.make_key(event)
+        while True:
+            result = self.store.get(key)
+            if result is not None:
+                return await self._answer_duplicate(event, result)
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                break
+            # Двойное нажатие, пока первая операция еще выполняется: ждем ее
+            await asyncio.shield(in_flight)
+
+        # Занимаем ключ до первого await, чтобы параллельный дубль нас дождался
+        self._in_flight[key] = asyncio.get_running_loop().create_future()
+        deferred = False
+        try:
+            result = await rq.get_processed_callback(key)
+            if result is not None:  # Выполнено до перезапуска или другим процессом
+                self.store.set(key, result)
+                return await self._answer_duplicate(event, result)
+
+            result = await handler(event, data)
+            if result is not None:
+                await rq.save_processed_callback(key, result)
+                deferred = self._defer(key, result)
+                await self._maybe_purge()
+            return result
+        finally:
+            if not deferred:
+                self._settle(key)
+
+    def _defer(self, key, result):
+        """Откладывает запись результата до commit сессии апдейта.
+
+        Возвращает False, если запись уже закоммичена (вне апдейта или через
+        единственного писателя) — тогда результат сохраняется сразу.
+        """
+        session = rq.current_session.get()
+        if session is None or write_queue.running:
+            self.store.set(key, result)
+            return False
+        session.info.setdefault('idempotency_pending', []).append((self, key, result))
+        return True
+
+    def _settle(self, key, result=None):
+        if result is not None:
+            self.store.set(key, result)
+        done = self._in_flight.pop(key, None)
+        if done is not None and not done.done():
+            done.set_result(None)
+
+    async def _answer_duplicate(self, event, result):
+        self.duplicates += 1
+        await event.answer(f"Уже выполнено: {result}")
+
+    async def _maybe_purge(self):
+        self._recorded += 1
+        if self._recorded % self.PURGE_EVERY == 0:
+            await rq.purge_processed_callbacks(datetime.utcnow() - self.durable_ttl)
+
+    def stats(self):
+        return {'cached': len(self.store), 'in_flight': len(self._in_flight), 'duplicates': self.duplicates}
+
+
+idempotency = IdempotencyMiddleware()
+
+
+@event.listens_for(Session, 'after_commit')
+def _settle_on_commit(session):
+    if not session.in_nested_transaction():
+        for middleware, key, result in session.info.pop('idempotency_pending', ()):
+            middleware._settle(key, result)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _settle_on_rollback(session):
+    if not session.in_nested_transaction():
+        for middleware, key, _ in session.info.pop('idempotency_pending', ()):
+            middleware._settle(key)
@@ -3,17 +3,15 @@ from aiogram.types import (ReplyKeyboardMarkup, KeyboardButton,
 
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from app.database.requests import get_categories, get_category_item, get_podcategories, get_items_by_podcategory
+from app.database.catalog import catalog
+from app.database.requests import get_items_page
 
 
-def business_keyboard(businesses, page: int = 0, items_per_page: int = 1):
+def business_keyboard(page):
+    """Клавиатура страницы бизнесов (результат rq.get_businesses_page)."""
     keyboard = InlineKeyboardBuilder()
-    
-    start = page * items_per_page
-    end = start + items_per_page
-    page_businesses = businesses[start:end]
 
-    for business in page_businesses:
+    for business in page.rows:
         keyboard.add(
             InlineKeyboardButton(
                 text=f"{business.type} | {business.name}" ,
@@ -22,12 +20,12 @@ def business_keyboard(businesses, page: int = 0, items_per_page: int = 1):
         )
     keyboard.adjust(2)
 
-    # Добавляем навигационные кнопки
+    # Добавляем навигационные кнопки: курсор — id крайнего бизнеса на странице
     navigation_buttons = []
-    if page > 0:
-        navigation_buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"page_business_{page - 1}"))
-    if end < len(businesses):
-        navigation_buttons.append(InlineKeyboardButton(text="➡️ Вперёд", callback_data=f"page_business_{page + 1}"))
+    if page.has_prev:
+        navigation_buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"page_business_p_{page.rows[0].id}"))
+    if page.has_next:
+        navigation_buttons.append(InlineKeyboardButton(text="➡️ Вперёд", callback_data=f"page_business_n_{page.rows[-1].id}"))
 
     if navigation_buttons:
         keyboard.row(*navigation_buttons)
@@ -60,7 +58,7 @@ def confirm_partner_contract_keyboard(initiator_business_id, amount):
 
 
 async def categories():
-    all_categories = await get_categories()
+    all_categories = await catalog.categories()
     if not all_categories:
         return InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="Категорий пока нет", callback_data="no_categories")]
@@ -77,8 +75,7 @@ async def categories():
     return keyboard.adjust(2).as_markup()
 
 async def podcategories(category_id):
-    podcategories = await get_podcategories(category_id)
-    podcategories_list = podcategories.all() 
+    podcategories_list = await catalog.podcategories(category_id)
     if not podcategories_list:
         return InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="Подкатегорий пока нет", callback_data="no_podcategories")]
@@ -104,28 +101,24 @@ async def podcategories(category_id):
 
     return keyboard.as_markup()
 
-async def items(podcategory_id, page: int = 0, items_per_page: int = 6):
-    all_items = await get_items_by_podcategory(podcategory_id)
-    
-    keyboard = InlineKeyboardBuilder()
+async def items(podcategory_id, after_id=None, before_id=None):
+    page = await get_items_page(podcategory_id, after_id=after_id, before_id=before_id)
 
-    start = page * items_per_page
-    end = start + items_per_page
-    page_items = all_items[start:end]
+    keyboard = InlineKeyboardBuilder()
 
     # Добавляем товары по 2 в строку
-    for item in page_items:
+    for item in page.rows:
         keyboard.add(InlineKeyboardButton(
             text=item.name[:20],  # Обрезаем название, если оно слишком длинное
             callback_data=f"item_{item.id}"
         ))
 
-    # Навигационные кнопки
+    # Навигационные кнопки: подкатегория и курсор передаются в callback_data
     navigation_buttons = []
-    if page > 0:
-        navigation_buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"page_items_{page - 1}"))
-    if end < len(all_items):
-        navigation_buttons.append(InlineKeyboardButton(text="➡️ Вперёд", callback_data=f"page_items_{page + 1}"))
+    if page.has_prev:
+        navigation_buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"page_items_{podcategory_id}_p_{page.rows[0].id}"))
+    if page.has_next:
+        navigation_buttons.append(InlineKeyboardButton(text="➡️ Вперёд", callback_data=f"page_items_{podcategory_id}_n_{page.rows[-1].id}"))
 
     if navigation_buttons:
         keyboard.row(*navigation_buttons)
@@ -163,7 +156,8 @@ def admin_keyboard():
         [InlineKeyboardButton(text="Снять деньги", callback_data="remove_money")],    
         [InlineKeyboardButton(text='Обновить ежемесячные затраты', callback_data="update_expenses")],
         [InlineKeyboardButton(text='Сделать отчет', callback_data="create_report")],
-        [InlineKeyboardButton(text='Инфляция +15%', callback_data="inflation")]
+        [InlineKeyboardButton(text='Отчет по страницам', callback_data="report_pages")],
+        [InlineKeyboardButton(text='Инфляция', callback_data="inflation")]
     ])
 
 
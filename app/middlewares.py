@@ -0,0 +1,58 @@
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject
+from typing import Any, Awaitable, Callable, Dict
+
+from app.database.requests import current_session
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Открывает одну сессию БД на апдейт (unit of work).
+
+    Сессия передается в обработчик как `session` и используется всеми
+    функциями app.database.requests внутри апдейта. При успешной обработке
+    изменения коммитятся одной транзакцией, при исключении — откатываются.
+    """
+    def __init__(self, session_pool):
+        self.session_pool = session_pool
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        async with self.session_pool() as session:
+            token = current_session.set(session)
+            data["session"] = session
+            try:
+                result = await handler(event, data)
+                await session.commit()
+                return result
+            except Exception:
+                await session.rollback()
+                raise
+            finally:
+                current_session.reset(token)
+
+
+class FlowExpiredMiddleware(BaseMiddleware):
+    """Сообщает пользователю, что его сценарий удален из хранилища FSM.
+
+    Работает с BoundedMemoryStorage: если состояние пользователя удалено по
+    TTL или вытеснено, на следующий апдейт он получит подсказку начать
+    заново, после чего апдейт обрабатывается как обычно.
+    """
+    TEXT = "⌛ Предыдущее действие было прервано из-за долгого бездействия. Начните его заново."
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        state = data.get("state")
+        if state is not None and state.storage.pop_tombstone(state.key):
+            message = event.message if isinstance(event, CallbackQuery) else event
+            if message is not None:
+                await message.answer(self.TEXT)
+        return await handler(event, data)
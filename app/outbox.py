@@ -0,0 +1,261 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.types import InlineKeyboardMarkup
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import app.database.requests as rq
+from app.broadcast import broadcaster
+
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxDispatcher:
+    """Фоновая отправка сообщений из таблицы outbox.
+
+    Обработчики не ходят в Telegram сами: они пишут сообщение в outbox в той
+    же транзакции, что и изменение в базе, и сообщение уходит только если
+    изменение закоммичено. Диспетчер забирает готовые к отправке сообщения,
+    отправляет их под общим с рассылками лимитом скорости (сообщения одного
+    чата — по порядку, разные чаты — параллельно) и сохраняет итог. Сетевые
+    ошибки повторяются с растущей паузой, RetryAfter откладывает сообщение
+    на указанное Telegram время.
+
+    В режиме сводки (configure_digest) посты в канал, кроме срочных тем,
+    копятся digest_window секунд от первого поста и уходят одним сообщением,
+    сгруппированным по хэштегам.
+    """
+    BATCH_SIZE = 100
+    MAX_ATTEMPTS = 8
+    MAX_BACKOFF = 600  # Секунд между повторами, не больше
+    POLL_INTERVAL = 30.0
+    KEEP_SENT = timedelta(days=7)
+    PURGE_INTERVAL = 3600.0
+    MESSAGE_LIMIT = 4096  # Символов в одном сообщении Telegram
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self._bot = None
+        self._task = None
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._purged_at = 0.0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.digest_window = 0
+        self.urgent_topics = None  # None — сводка выключена
+        self.digests = 0
+        self.coalesced = 0
+
+    def configure_digest(self, window, urgent_topics=()):
+        """Включает сводку постов в канал; window=0 выключает ее."""
+        self.digest_window = window
+        self.urgent_topics = [topic if topic.startswith('#') else f'#{topic}'
+                              for topic in urgent_topics] if window else None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def start(self, bot):
+        if self.running:
+            return
+        self._bot = bot
+        self._stopping = False
+        self._task = asyncio.create_task(self._run(), name='outbox')
+
+    async def stop(self):
+        """Дожидается текущей пачки; неотправленное уйдет после перезапуска."""
+        if not self.running:
+            return
+        self._stopping = True
+        self._wake.set()
+        await self._task
+        self._task = None
+
+    def wake(self):
+        self._wake.set()
+
+    async def _run(self):
+        while not self._stopping:
+            self._wake.clear()
+            try:
+                batch = await rq.get_due_outbox(self.BATCH_SIZE, self.urgent_topics)
+                if batch:
+                    await rq.mark_outbox(await self._send_batch(batch))
+                    continue  # Сразу за следующей пачкой
+                digest_due = await self._flush_digest()
+                await self._maybe_purge()
+                timeout = await self._idle_timeout(digest_due)
+            except Exception:
+                logger.exception('Ошибка отправки outbox')
+                timeout = self.POLL_INTERVAL
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _idle_timeout(self, digest_due=None):
+        # Спим до ближайшей отложенной попытки или сводки, но не дольше POLL_INTERVAL
+        wake_at = [moment for moment in (await rq.get_next_outbox_attempt(self.urgent_topics), digest_due)
+                   if moment is not None]
+        if not wake_at:
+            return self.POLL_INTERVAL
+        delay = (min(wake_at) - datetime.utcnow()).total_seconds()
+        return min(max(delay, 0.1), self.POLL_INTERVAL)
+
+    async def _flush_digest(self):
+        """Отправляет сводку, если окно истекло; иначе возвращает время ее отправки."""
+        if self.urgent_topics is None:
+            return None
+        posts = await rq.get_digest_posts(self.urgent_topics)
+        if not posts:
+            return None
+        due = min(post.created_at for post in posts) + timedelta(seconds=self.digest_window)
+        if due > datetime.utcnow():
+            return due
+
+        results = []
+        for text, chunk in compose_digest(posts, self.MESSAGE_LIMIT):
+            attempts = max(post.attempts for post in chunk)
+            outcome = await self._send([post.id for post in chunk], attempts, None, text)
+            if outcome[0]['status'] == 'sent':
+                self.digests += 1
+                self.coalesced += len(chunk)
+            results += outcome
+        await rq.mark_outbox(results)
+        return None
+
+    async def _send_batch(self, batch):
+        by_chat = {}
+        for message in batch:
+            by_chat.setdefault(message.chat_id, []).append(message)
+
+        results = []
+
+        async def send_chat(messages):
+            for number, message in enumerate(messages):
+                [result] = await self._send([message.id], message.attempts, message.chat_id,
+                                            message.text, message.reply_markup)
+                results.append(result)
+                if result['status'] == 'pending':
+                    # Следующие сообщения этого чата ждут, чтобы не нарушить порядок
+                    for later in messages[number + 1:]:
+                        results.append({'id': later.id, 'status': 'pending',
+                                        'next_attempt_at': result['next_attempt_at']})
+                    return
+
+        await asyncio.gather(*(send_chat(messages) for messages in by_chat.values()))
+        return results
+
+    async def _send(self, ids, attempts, chat_id, text, reply_markup=None):
+        """Одна попытка отправки; возвращает итог для каждой строки outbox из ids.
+
+        Обычное сообщение — одна строка, сводка — все посты, вошедшие в нее.
+        """
+        if chat_id is None:
+            chat_id = os.getenv('CHANNEL_ID')
+        reply_markup = InlineKeyboardMarkup.model_validate_json(reply_markup) if reply_markup else None
+        await self.limiter.acquire()
+        try:
+            await self._bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+        except TelegramRetryAfter as e:
+            self.retries += 1
+            self.limiter.pause(e.retry_after)
+            return self._retry(ids, attempts, e.retry_after, str(e))
+        except (TelegramNetworkError, TelegramServerError) as e:
+            self.retries += 1
+            if attempts + 1 >= self.MAX_ATTEMPTS:
+                return self._fail(ids, attempts + 1, e)
+            return self._retry(ids, attempts + 1, min(2 ** (attempts + 1), self.MAX_BACKOFF), str(e))
+        except TelegramAPIError as e:
+            return self._fail(ids, attempts + 1, e)
+        self.sent += 1
+        sent_at = datetime.utcnow()
+        return [{'id': id, 'status': 'sent', 'attempts': attempts + 1, 'sent_at': sent_at, 'error': None}
+                for id in ids]
+
+    @staticmethod
+    def _retry(ids, attempts, delay, error):
+        next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        return [{'id': id, 'status': 'pending', 'attempts': attempts,
+                 'next_attempt_at': next_attempt_at, 'error': error[:200]} for id in ids]
+
+    def _fail(self, ids, attempts, error):
+        self.failed += 1
+        logger.warning('Сообщение outbox %s не отправлено: %s', ids, error)
+        return [{'id': id, 'status': 'failed', 'attempts': attempts, 'error': str(error)[:200]} for id in ids]
+
+    async def _maybe_purge(self):
+        loop = asyncio.get_running_loop()
+        if loop.time() - self._purged_at < self.PURGE_INTERVAL:
+            return
+        self._purged_at = loop.time()
+        await rq.purge_outbox(datetime.utcnow() - self.KEEP_SENT)
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retries': self.retries,
+            'digest_window': self.digest_window,
+            'digests': self.digests,
+            'coalesced': self.coalesced,
+        }
+
+
+def compose_digest(posts, limit):
+    """Собирает посты в сводку по хэштегам.
+
+    Возвращает список (текст, посты): если сводка не помещается в одно
+    сообщение, она делится на несколько, заголовок темы повторяется.
+    """
+    topics = {}
+    for post in posts:
+        topics.setdefault(post.topic, []).append(post)
+
+    chunks = []
+    lines, chunk, size = [], [], 0
+    for topic, topic_posts in topics.items():
+        header = f"{topic} ({len(topic_posts)})" if topic else "Другое"
+        header_added = False
+        for post in topic_posts:
+            line = "• " + (post.text.replace(topic, "") if topic else post.text).strip()
+            extra = len(line) + 1 + (0 if header_added else len(header) + 2)
+            if chunk and size + extra > limit:
+                chunks.append(("\n".join(lines).strip(), chunk))
+                lines, chunk, size, header_added = [], [], 0, False
+                extra = len(line) + len(header) + 3
+            if not header_added:
+                lines += ["", header]
+                header_added = True
+            lines.append(line[:limit - len(header) - 3])
+            chunk.append(post)
+            size += extra
+    if chunk:
+        chunks.append(("\n".join(lines).strip(), chunk))
+    return chunks
+
+
+# Общий с рассылками лимит: у бота один бюджет сообщений в секунду
+dispatcher = OutboxDispatcher(broadcaster.limiter)
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_on_commit(session):
+    # Для точки сохранения событие тоже приходит, но строки еще не видны диспетчеру
+    if not session.in_nested_transaction() and session.info.pop('outbox_added', False):
+        dispatcher.wake()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_outbox(session):
+    if not session.in_nested_transaction():
+        session.info.pop('outbox_added', None)
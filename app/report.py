@@ -0,0 +1,126 @@
+import asyncio
+import itertools
+from collections import OrderedDict, defaultdict
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+
+# Лимит Telegram на длину текста сообщения
+MESSAGE_LIMIT = 4096
+# С какого числа компаний форматирование уходит в отдельный поток
+THREAD_THRESHOLD = 300
+# Сколько снимков отчета храним для постраничного просмотра
+MAX_SNAPSHOTS = 20
+
+
+def report_lines(report_data):
+    """Построчно формирует текст отчета из BusinessReport."""
+    yield "🏢 Все компании по прибыли (от большего к меньшему):\n\n"
+    # Компании уже отсортированы по прибыли в базе — группируем за один проход
+    companies_by_type = defaultdict(list)
+    for idx, company in enumerate(report_data.companies, 1):
+        companies_by_type[company.type].append(company)
+        yield (f"{idx}. {company.name} ({company.type}) — 💰 Бюджет: {company.budget} ₽,\n"
+               f" 💵 Доход: {company.income} ₽, 📉 Расход: {company.cost} ₽, 📊 Прибыль: {company.profit} ₽\n")
+
+    yield "\n📊 Сравнение по категориям бизнеса:\n\n"
+    for summary in report_data.summaries:
+        yield (f"{summary.type}\n"
+               f"🔹 Количество компаний: {summary.count}\n"
+               f"💵 Общий бюджет: {summary.budget} ₽\n"
+               f"💰 Общий доход: {summary.income} ₽\n"
+               f"📉 Общий расход: {summary.cost} ₽\n"
+               f"📊 Общая прибыль: {summary.profit} ₽\n"
+               f"🏢 Компании:\n")
+        for company in companies_by_type[summary.type]:
+            yield (f"   - {company.name}:  💰 Бюджет: {company.budget} ₽, 💵 Доход: {company.income} ₽, "
+                   f"📉 Расход: {company.cost} ₽, 📊 Прибыль: {company.profit} ₽\n")
+        yield "\n"  # Отделяем категории
+
+
+def chunk_lines(lines, limit=MESSAGE_LIMIT):
+    """Собирает строки в куски не длиннее limit символов.
+
+    Строки не разрываются, если помещаются в сообщение; куски собираются
+    через join, без повторного копирования растущей строки. Пустые куски
+    (только пробелы и переводы строк) пропускаются.
+    """
+    chunk, size = [], 0
+    for line in lines:
+        length = text_length(line)
+        while length > limit:  # Слишком длинная строка режется по лимиту
+            yield from _flush_chunk(chunk)
+            chunk, size = [], 0
+            yield line[:limit // 2]
+            line = line[limit // 2:]
+            length = text_length(line)
+        if size + length > limit:
+            yield from _flush_chunk(chunk)
+            chunk, size = [], 0
+        chunk.append(line)
+        size += length
+    yield from _flush_chunk(chunk)
+
+
+def text_length(text):
+    """Длина текста так, как ее считает Telegram (в кодовых единицах UTF-16)."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _flush_chunk(chunk):
+    text = "".join(chunk)
+    if text.strip():
+        yield text
+
+
+def render_report(report_data, limit=MESSAGE_LIMIT):
+    return list(chunk_lines(report_lines(report_data), limit))
+
+
+async def render_report_async(report_data, limit=MESSAGE_LIMIT):
+    """Форматирует отчет; большой отчет — в отдельном потоке, не блокируя бота."""
+    if len(report_data.companies) >= THREAD_THRESHOLD:
+        return await asyncio.to_thread(render_report, report_data, limit)
+    return render_report(report_data, limit)
+
+
+async def send_report(message, report_data):
+    """Отправляет отчет по порядку несколькими сообщениями в пределах лимита."""
+    if len(report_data.companies) >= THREAD_THRESHOLD:
+        chunks = await render_report_async(report_data)
+    else:
+        # Небольшой отчет отправляем по мере формирования кусков
+        chunks = chunk_lines(report_lines(report_data))
+    for chunk in chunks:
+        await message.answer(chunk)
+
+
+class ReportSnapshots:
+    """Снимки отчета для постраничного просмотра без повторного расчета."""
+    def __init__(self, max_snapshots=MAX_SNAPSHOTS):
+        self.max_snapshots = max_snapshots
+        self._snapshots = OrderedDict()
+        self._ids = itertools.count(1)
+
+    def add(self, pages):
+        snapshot_id = next(self._ids)
+        self._snapshots[snapshot_id] = pages
+        while len(self._snapshots) > self.max_snapshots:
+            self._snapshots.popitem(last=False)
+        return snapshot_id
+
+    def get(self, snapshot_id):
+        return self._snapshots.get(snapshot_id)
+
+
+report_snapshots = ReportSnapshots()
+
+
+def report_page_keyboard(snapshot_id, page, total_pages):
+    navigation_buttons = []
+    if page > 0:
+        navigation_buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"report_page_{snapshot_id}_{page - 1}"))
+    navigation_buttons.append(InlineKeyboardButton(text=f"{page + 1}/{total_pages}", callback_data="report_page_noop"))
+    if page < total_pages - 1:
+        navigation_buttons.append(InlineKeyboardButton(text="➡️ Вперёд", callback_data=f"report_page_{snapshot_id}_{page + 1}"))
+    return InlineKeyboardMarkup(inline_keyboard=[navigation_buttons])
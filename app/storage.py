@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DEFAULT_DESTINY
+
+import app.database.requests as rq
+from app.database.fsm import fsm_cache
+
+
+logger = logging.getLogger(__name__)
+
+
+def storage_key(key):
+    """Компактный строковый ключ: бот:чат:пользователь[:тред][:бизнес][:destiny]."""
+    parts = [str(key.bot_id), str(key.chat_id), str(key.user_id)]
+    if key.thread_id or key.business_connection_id or key.destiny != DEFAULT_DESTINY:
+        parts += [str(key.thread_id or ''), key.business_connection_id or '']
+    if key.destiny != DEFAULT_DESTINY:
+        parts.append(key.destiny)
+    return ':'.join(parts)
+
+
+class DbStorage(BaseStorage):
+    """Хранилище FSM aiogram в базе (таблица fsm_states).
+
+    Сценарии переживают перезапуск, и несколько процессов бота видят одно и
+    то же состояние. Запись идет в сессии текущего апдейта, то есть в одной
+    транзакции с изменениями обработчика. Найденные записи кэшируются в
+    fsm_cache; пока процессов несколько, запись из кэша используется, только
+    если ее updated_at совпадает с базой — сверка читает одну колонку по
+    первичному ключу вместо состояния и данных. При single_process=True
+    кэшу доверяют без сверки. Состояния, не менявшиеся дольше ttl,
+    считаются пустыми; фоновая задача удаляет их пачками.
+    """
+    PURGE_BATCH = 1000
+
+    def __init__(self, ttl=timedelta(days=1), purge_interval=3600, cache=fsm_cache, single_process=False):
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.cache = cache
+        self.single_process = single_process
+        self._task = None
+        self.purged = 0
+
+    async def _load(self, key):
+        found, record = self.cache.get(key)
+        if found and not self.single_process:
+            # Другой процесс мог изменить или удалить запись
+            if await rq.get_fsm_version(key) != record.updated_at:
+                self.cache.mark_stale(key)
+                found = False
+        if not found:
+            record = await rq.get_fsm_record(key)
+            self.cache.put(key, record)
+        if record is None or record.updated_at < datetime.utcnow() - self.ttl:
+            return None
+        return record
+
+    async def set_state(self, key, state=None):
+        state = state.state if isinstance(state, State) else state
+        await rq.save_fsm_field(storage_key(key), 'state', state)
+
+    async def get_state(self, key):
+        record = await self._load(storage_key(key))
+        return record.state if record else None
+
+    async def set_data(self, key, data):
+        value = json.dumps(data, ensure_ascii=False, separators=(',', ':')) if data else None
+        await rq.save_fsm_field(storage_key(key), 'data', value)
+
+    async def get_data(self, key):
+        record = await self._load(storage_key(key))
+        return json.loads(record.data) if record and record.data else {}
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name='fsm-purge')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def close(self):
+        await self.stop()
+
+    async def purge(self):
+        """Удаляет устаревшие состояния пачками, каждая в своей транзакции."""
+        older_than = datetime.utcnow() - self.ttl
+        purged = 0
+        while True:
+            deleted = await rq.purge_fsm_batch(older_than, self.PURGE_BATCH)
+            purged += deleted
+            if deleted < self.PURGE_BATCH:
+                break
+            await asyncio.sleep(0)  # Между пачками даем пройти апдейтам
+        self.purged += purged
+        return purged
+
+    async def _run(self):
+        while True:
+            try:
+                purged = await self.purge()
+                if purged:
+                    logger.info('Удалено %s устаревших состояний FSM', purged)
+            except Exception:
+                logger.exception('Ошибка очистки состояний FSM')
+            await asyncio.sleep(self.purge_interval)
+
+    def stats(self):
+        return {'storage': 'db', **self.cache.stats(), 'purged': self.purged}
+
+
+class BoundedMemoryStorage(BaseStorage):
+    """Хранилище FSM в памяти процесса с ограничением по времени и размеру.
+
+    В отличие от MemoryStorage, пустые ключи не хранятся, запись удаляется,
+    если к ней не обращались ttl секунд, а при превышении max_entries
+    вытесняется запись, к которой дольше всех не обращались. Ключи
+    удаленных посреди сценария записей запоминаются (не больше
+    max_entries), чтобы FlowExpiredMiddleware сообщил пользователю, что
+    сценарий нужно начать заново.
+    """
+    def __init__(self, ttl=timedelta(days=1), max_entries=10_000):
+        self.ttl = ttl.total_seconds()
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # StorageKey -> [state, data, последнее обращение]
+        self._tombstones = OrderedDict()  # StorageKey -> момент удаления
+        self.evicted = 0
+        self.expired = 0
+
+    def _entry(self, key):
+        now = time.monotonic()
+        self._sweep(now)
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry[2] = now
+            self._entries.move_to_end(key)
+        return entry
+
+    def _sweep(self, now):
+        # Записи упорядочены по последнему обращению: устаревшие — в начале
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if now - entry[2] <= self.ttl:
+                break
+            self._drop(key, now)
+            self.expired += 1
+        while self._tombstones:
+            key, dropped_at = next(iter(self._tombstones.items()))
+            if now - dropped_at <= self.ttl:
+                break
+            del self._tombstones[key]
+
+    def _drop(self, key, now):
+        state = self._entries.pop(key)[0]
+        if state is not None:
+            self._tombstones[key] = now
+            self._tombstones.move_to_end(key)
+            if len(self._tombstones) > self.max_entries:
+                self._tombstones.popitem(last=False)
+
+    def _store(self, key, index, value):
+        entry = self._entry(key)
+        if entry is None:
+            if not value:
+                return
+            entry = self._entries[key] = [None, {}, time.monotonic()]
+            self._tombstones.pop(key, None)
+        entry[index] = value
+        if entry[0] is None and not entry[1]:
+            del self._entries[key]
+            return
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)), time.monotonic())
+            self.evicted += 1
+
+    async def set_state(self, key, state=None):
+        self._store(key, 0, state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key):
+        entry = self._entry(key)
+        return entry[0] if entry else None
+
+    async def set_data(self, key, data):
+        self._store(key, 1, dict(data))
+
+    async def get_data(self, key):
+        entry = self._entry(key)
+        return dict(entry[1]) if entry else {}
+
+    def pop_tombstone(self, key):
+        """True, если сценарий пользователя был удален по TTL или вытеснен."""
+        return self._tombstones.pop(key, None) is not None
+
+    async def close(self):
+        pass
+
+    def stats(self):
+        return {
+            'storage': 'memory',
+            'live': len(self._entries),
+            'max_entries': self.max_entries,
+            'evicted': self.evicted,
+            'expired': self.expired,
+            'tombstones': len(self._tombstones),
+        }
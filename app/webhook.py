@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import secrets
+import signal
+from urllib.parse import urlsplit
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookHandler(SimpleRequestHandler):
+    """Прием апдейтов от Telegram по вебхуку.
+
+    Telegram получает ответ сразу, апдейт обрабатывается в фоне; одновременно
+    обрабатывается не больше max_updates апдейтов, остальные ждут очереди.
+    Запросы без верного секретного токена отклоняются с 401. При остановке
+    drain дожидается апдейтов, которые уже в обработке.
+    """
+    def __init__(self, dispatcher, bot, secret_token, max_updates=100):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token)
+        self._slots = asyncio.Semaphore(max_updates)
+        self._in_flight = set()
+
+    async def _background_feed_update(self, bot, update):
+        task = asyncio.current_task()
+        self._in_flight.add(task)
+        try:
+            async with self._slots:
+                await super()._background_feed_update(bot, update)
+        except Exception:
+            # Telegram уже получил ответ, ошибку остается только записать
+            logger.exception('Ошибка обработки апдейта %s', update.get('update_id'))
+        finally:
+            self._in_flight.discard(task)
+
+    async def drain(self, timeout):
+        if not self._in_flight:
+            return
+        _, pending = await asyncio.wait(set(self._in_flight), timeout=timeout)
+        if pending:
+            logger.warning('Остановка: %s апдейтов не успели обработаться', len(pending))
+
+
+async def run_webhook(dp, bot, url, secret_token=None, host='0.0.0.0', port=8080,
+                      max_updates=100, drain_timeout=25):
+    """Запускает aiohttp-сервер вебхука и работает до SIGTERM или SIGINT.
+
+    Путь сервера берется из url (https://example.com/tg -> /tg). Если секрет
+    не задан, он генерируется на каждый запуск: set_webhook все равно
+    вызывается при старте. При остановке сервер перестает принимать запросы,
+    дожидается начатых апдейтов, затем выполняет dp.shutdown (фоновые задачи
+    успевают сохранить свое состояние) и закрывает сессию бота. Вебхук не
+    удаляется: апдейты, пришедшие во время перезапуска, Telegram доставит позже.
+    """
+    secret_token = secret_token or secrets.token_urlsafe(32)
+    path = urlsplit(url).path or '/'
+
+    app = web.Application()
+    handler = WebhookHandler(dp, bot, secret_token, max_updates)
+
+    async def drain(app):
+        await handler.drain(drain_timeout)
+
+    # Порядок on_shutdown: дождаться апдейтов, dp.shutdown, закрыть сессию бота
+    app.on_shutdown.append(drain)
+    setup_application(app, dp, bot=bot)
+    handler.register(app, path=path)
+
+    runner = web.AppRunner(app)
+    await runner.setup()  # Здесь же выполняется dp.startup
+    try:
+        await web.TCPSite(runner, host, port).start()
+        await bot.set_webhook(
+            url,
+            secret_token=secret_token,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=max_updates,
+        )
+        logger.info('Вебхук %s, сервер %s:%s', url, host, port)
+        await _wait_for_signal()
+    finally:
+        await runner.cleanup()
+
+
+async def _wait_for_signal():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows: остается KeyboardInterrupt
+    await stop.wait()
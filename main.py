@@ -2,18 +2,82 @@ import asyncio
 from aiogram import Bot, Dispatcher
 from dotenv import load_dotenv
 import os
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import BotCommand
-from app.database.models import async_main
+from app.database.models import async_session
+from app.database.migrations import migrate
+from app.database.catalog import catalog
+from app.database.events import event_sink
+from app.database.profiles import resolve_profile
+from app.database.writer import write_queue
+from app.database.retention import RetentionJob
 from app.hendlers import router as user_router
 from app.admin import admin as admin_router
+from app.middlewares import DbSessionMiddleware, FlowExpiredMiddleware
+from app.idempotency import idempotency
+from app.broadcast import broadcaster
+from app.outbox import dispatcher as outbox_dispatcher
+from app.webhook import run_webhook
+from app.storage import DbStorage, BoundedMemoryStorage
 
 async def main():
     load_dotenv()
-    await async_main()
+    await migrate()  # Схема проверяется одним запросом к schema_version
+    await catalog.load()  # Каталог читается из памяти, в базу только при изменениях
 
     bot = Bot(token=os.getenv('TOKEN'))
-    dp = Dispatcher(storage=MemoryStorage())
+    # Состояния сценариев в базе: переживают перезапуск и общие для процессов.
+    # FSM_STORAGE=memory — в памяти процесса с TTL и ограничением числа записей.
+    # FSM_SINGLE_PROCESS=1 — бот запущен в одном процессе, кэш состояний не сверяется с базой
+    if os.getenv('FSM_STORAGE', 'db') == 'memory':
+        storage = BoundedMemoryStorage()
+    else:
+        storage = DbStorage(single_process=os.getenv('FSM_SINGLE_PROCESS') == '1')
+    dp = Dispatcher(storage=storage)
+
+    # Одна сессия БД (и одна транзакция) на каждый апдейт
+    dp.update.outer_middleware(DbSessionMiddleware(async_session))
+
+    # SQLite: все записи через одного писателя, который объединяет их в общие транзакции
+    _, profile = resolve_profile(os.getenv('SQLALCHEMY_URL'), os.getenv('DB_PROFILE'))
+    if profile.write_queue:
+        dp.startup.register(write_queue.start)
+        dp.shutdown.register(write_queue.stop)
+
+    # Рассылки уходят в фоне с общим лимитом скорости и продолжаются после перезапуска
+    dp.startup.register(broadcaster.start)
+    dp.shutdown.register(broadcaster.stop)
+
+    # Брошенные сценарии удаляются из fsm_states пачками по TTL
+    if isinstance(storage, DbStorage):
+        dp.startup.register(storage.start)
+        dp.shutdown.register(storage.stop)
+    else:
+        # Пользователь узнает, что его сценарий удален из памяти и его нужно начать заново
+        dp.message.outer_middleware(FlowExpiredMiddleware())
+        dp.callback_query.outer_middleware(FlowExpiredMiddleware())
+
+    # Сообщения и посты в канал, записанные обработчиками в outbox
+    digest_window = os.getenv('CHANNEL_DIGEST_WINDOW')
+    if digest_window:
+        # Посты в канал копятся и уходят одной сводкой по хэштегам; срочные темы — сразу
+        urgent_topics = [topic.strip() for topic in os.getenv('CHANNEL_URGENT_TOPICS', '').split(',') if topic.strip()]
+        outbox_dispatcher.configure_digest(int(digest_window), urgent_topics)
+    dp.startup.register(outbox_dispatcher.start)
+    dp.shutdown.register(outbox_dispatcher.stop)
+
+    # Журнал событий пишется в фоне пачками; при остановке очередь сбрасывается
+    dp.startup.register(event_sink.start)
+    dp.shutdown.register(event_sink.stop)
+
+    # Старые события переносятся в сжатый архив, таблица events не растет бесконечно
+    retention_days = os.getenv('EVENT_RETENTION_DAYS')
+    if retention_days:
+        retention = RetentionJob(older_than_days=int(retention_days))
+        dp.startup.register(retention.start)
+        dp.shutdown.register(retention.stop)
+
+    # Повторные нажатия кнопок с деньгами получают сохраненный ответ
+    user_router.callback_query.middleware(idempotency)
 
     # Регистрируем обработчики
     dp.include_routers(user_router, admin_router) # Пользовательские обработчики
@@ -23,7 +87,20 @@ async def main():
         BotCommand(command="my_business", description="Моя компания"),
     ])
 
-    await dp.start_polling(bot)
+    webhook_url = os.getenv('WEBHOOK_URL')
+    if webhook_url:
+        # Telegram сам присылает апдейты на WEBHOOK_URL, они обрабатываются параллельно
+        await run_webhook(
+            dp, bot, webhook_url,
+            secret_token=os.getenv('WEBHOOK_SECRET'),
+            host=os.getenv('WEBHOOK_HOST', '0.0.0.0'),
+            port=int(os.getenv('WEBHOOK_PORT', '8080')),
+            max_updates=int(os.getenv('WEBHOOK_MAX_UPDATES', '100')),
+        )
+    else:
+        # Для разработки: long polling; вебхук, оставшийся от прода, мешал бы getUpdates
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
 
 
 
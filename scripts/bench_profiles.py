@@ -0,0 +1,123 @@
+"""Сравнение профилей движка БД на оформлении заказов.
+
+Для каждого профиля в отдельном процессе создается база, после чего
+параллельно выполняется сценарий заказа: два add_to_cart и checkout на
+игрока. Печатаются пропускная способность, задержки сценария и число
+ошибок (например, "database is locked").
+
+    python -m scripts.bench_profiles [заказов] [параллельно]
+
+Профиль postgres-prod замеряется, только если задан BENCH_POSTGRES_URL —
+URL отдельной пустой базы, ее таблицы будут заполнены тестовыми данными.
+"""
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def seed(orders):
+    from sqlalchemy import insert
+
+    from app.database.migrations import migrate
+    from app.database.models import async_session, Business, Category, Podcategory, Item, User
+
+    await migrate()
+    async with async_session() as session:
+        await session.execute(insert(Business), [
+            {'type': 'курьер', 'name': 'Курьер', 'budget': 0, 'income': 0, 'cost': 0, 'expenses': 0},
+        ] + [
+            {'type': 'магазин', 'name': f'Магазин {i}', 'budget': 1_000_000, 'income': 0, 'cost': 0, 'expenses': 0}
+            for i in range(orders)
+        ])
+        await session.execute(insert(User), [
+            {'tg_id': 1000 + i, 'business_id': i + 1} for i in range(orders + 1)
+        ])
+        session.add(Category(name='Категория'))
+        await session.flush()
+        session.add(Podcategory(name='Подкатегория', category=1))
+        await session.flush()
+        session.add_all([
+            Item(name='Товар 1', description='', price=100, weight=1.5, podcategory=1),
+            Item(name='Товар 2', description='', price=40, weight=0.5, podcategory=1),
+        ])
+        await session.commit()
+
+
+async def worker(orders, concurrency):
+    import app.database.requests as rq
+    from app.database.models import get_engine
+
+    await seed(orders)
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = {}
+
+    async def order_flow(player):
+        # user_id игрока = player + 2: первый пользователь — владелец курьерской компании
+        async with limit:
+            started = time.perf_counter()
+            try:
+                await rq.add_to_cart(player + 2, 1, 2)
+                await rq.add_to_cart(player + 2, 2, 1)
+                await rq.checkout(1001 + player)
+            except Exception as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            else:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(order_flow(player) for player in range(orders)))
+    elapsed = time.perf_counter() - started
+    await get_engine().dispose()
+    return {'elapsed': elapsed, 'latencies': latencies, 'errors': errors}
+
+
+def run_profile(profile, url, orders, concurrency):
+    env = dict(os.environ, DB_PROFILE=profile, SQLALCHEMY_URL=url)
+    output = subprocess.run(
+        [sys.executable, '-m', 'scripts.bench_profiles', '--worker', str(orders), str(concurrency)],
+        env=env, check=True, capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    if sys.argv[1:2] == ['--worker']:
+        print(json.dumps(asyncio.run(worker(int(sys.argv[2]), int(sys.argv[3])))))
+        return
+
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    directory = tempfile.mkdtemp()
+    targets = [
+        ('sqlite-dev', f'sqlite+aiosqlite:///{os.path.join(directory, "dev.db")}'),
+        ('sqlite-prod', f'sqlite+aiosqlite:///{os.path.join(directory, "prod.db")}'),
+    ]
+    if os.getenv('BENCH_POSTGRES_URL'):
+        targets.append(('postgres-prod', os.getenv('BENCH_POSTGRES_URL')))
+
+    print(f'{orders} заказов, {concurrency} параллельно')
+    print(f'{"профиль":<15} {"заказов/с":>10} {"p50, мс":>9} {"p99, мс":>9}  ошибки')
+    for profile, url in targets:
+        result = run_profile(profile, url, orders, concurrency)
+        latencies = result['latencies']
+        throughput = len(latencies) / result['elapsed']
+        p50 = statistics.median(latencies) * 1000 if latencies else 0
+        p99 = percentile(latencies, 0.99) * 1000 if latencies else 0
+        errors = ', '.join(f'{name}: {count}' for name, count in result['errors'].items()) or '-'
+        print(f'{profile:<15} {throughput:>10.1f} {p50:>9.1f} {p99:>9.1f}  {errors}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Сравнение ORM-загрузки с selectin и проекций на __slots__-записях.
+
+Заполняет временную SQLite-базу бизнесами и пользователями и для каждого
+сценария замеряет среднее время вызова и пик памяти (tracemalloc).
+
+    python -m scripts.bench_projections [бизнесов] [пользователей_на_бизнес]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['SQLALCHEMY_URL'] = f'sqlite+aiosqlite:///{DB_PATH}'
+
+from sqlalchemy import insert, select  # noqa: E402
+
+from app.database.models import async_session, get_engine, Business, User  # noqa: E402
+import app.database.requests as rq  # noqa: E402
+from app.database.migrations import migrate  # noqa: E402
+
+REPEATS = 20
+
+
+async def orm_all_businesses():
+    # Так работал get_all_businesses до проекций: бизнесы + все их пользователи
+    async with async_session() as session:
+        return (await session.scalars(select(Business))).all()
+
+
+async def orm_all_users():
+    async with async_session() as session:
+        return (await session.scalars(select(User))).all()
+
+
+async def orm_my_business(tg_id):
+    # Так /my_business читал пользователя: пользователь -> бизнес -> все его пользователи
+    async with async_session() as session:
+        user = await session.scalar(select(User).where(User.tg_id == tg_id))
+        business = user.business
+        return business.type, business.name, business.budget, business.expenses
+
+
+async def my_business_projection(tg_id):
+    rq.identity_cache.invalidate_user(tg_id)  # Честное сравнение: без попадания в кэш
+    identity = await rq.get_identity(tg_id)
+    return await rq.get_balance_card(identity.business_id)
+
+
+async def seed(businesses, users_per_business):
+    await migrate()
+    async with async_session() as session:
+        await session.execute(insert(Business), [
+            {'type': 'магазин', 'name': f'Компания {i}', 'budget': 1000, 'income': 0, 'cost': 0, 'expenses': 10}
+            for i in range(businesses)
+        ])
+        await session.execute(insert(User), [
+            {'tg_id': 100_000 + i, 'business_id': i // users_per_business + 1}
+            for i in range(businesses * users_per_business)
+        ])
+        await session.commit()
+
+
+async def measure(call):
+    await call()  # Прогрев: кэш скомпилированных запросов, соединение в пуле
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        await call()
+    elapsed = (time.perf_counter() - started) / REPEATS
+
+    tracemalloc.start()
+    result = await call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, peak
+
+
+async def run(businesses, users_per_business):
+    await seed(businesses, users_per_business)
+    tg_id = 100_000 + businesses * users_per_business // 2
+    scenarios = [
+        ('все бизнесы', orm_all_businesses, rq.get_all_businesses),
+        ('все пользователи', orm_all_users, rq.get_users),
+        ('/my_business', lambda: orm_my_business(tg_id),
+         lambda: my_business_projection(tg_id)),
+    ]
+    print(f'{businesses} бизнесов, {businesses * users_per_business} пользователей, {REPEATS} повторов')
+    print(f'{"сценарий":<18} {"ORM, мс":>9} {"проекция, мс":>13} {"ORM, КБ":>9} {"проекция, КБ":>13}')
+    for name, orm_call, projection_call in scenarios:
+        orm_time, orm_peak = await measure(orm_call)
+        projection_time, projection_peak = await measure(projection_call)
+        print(f'{name:<18} {orm_time * 1000:>9.2f} {projection_time * 1000:>13.2f} '
+              f'{orm_peak / 1024:>9.0f} {projection_peak / 1024:>13.0f}')
+    await get_engine().dispose()
+
+
+def main():
+    businesses = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    users_per_business = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    asyncio.run(run(businesses, users_per_business))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Замер холодного старта: импорт пакета и проверка схемы БД.
+
+Каждый замер выполняется в отдельном процессе, чтобы не мешали кэши
+модулей и соединений. Печатает медиану по нескольким запускам.
+
+    python -m scripts.bench_startup [запусков]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+IMPORT_MODELS = '''
+import time
+started = time.perf_counter()
+import app.database.models
+print(time.perf_counter() - started)
+'''
+
+IMPORT_BOT = '''
+import time
+started = time.perf_counter()
+import main
+print(time.perf_counter() - started)
+'''
+
+# Проверка схемы при старте; движок создается до начала замера
+MIGRATE = '''
+import asyncio, time
+from app.database.models import get_engine
+from app.database.migrations import migrate
+
+async def run():
+    engine = get_engine()
+    started = time.perf_counter()
+    await migrate(engine)
+    elapsed = time.perf_counter() - started
+    await engine.dispose()
+    return elapsed
+
+print(asyncio.run(run()))
+'''
+
+
+def run_snippet(code, env):
+    output = subprocess.run(
+        [sys.executable, '-c', code], env=env, check=True, capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    ).stdout
+    return float(output.strip().splitlines()[-1]) * 1000
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    directory = tempfile.mkdtemp()
+    env = dict(os.environ)
+
+    def fresh_db(name):
+        env['SQLALCHEMY_URL'] = f'sqlite+aiosqlite:///{os.path.join(directory, name)}'
+
+    results = {}
+    fresh_db('imports.db')
+    results['импорт app.database.models'] = [run_snippet(IMPORT_MODELS, env) for _ in range(runs)]
+    results['импорт main (aiogram и обработчики)'] = [run_snippet(IMPORT_BOT, env) for _ in range(runs)]
+
+    first, again = [], []
+    for number in range(runs):
+        fresh_db(f'schema_{number}.db')
+        first.append(run_snippet(MIGRATE, env))
+        again.append(run_snippet(MIGRATE, env))
+    results['схема: новая база'] = first
+    results['схема: актуальная база'] = again
+
+    for name, values in results.items():
+        print(f'{name:<38} {statistics.median(values):>8.1f} мс')
+
+
+if __name__ == '__main__':
+    main()
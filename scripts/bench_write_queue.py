@@ -0,0 +1,108 @@
+"""Всплеск одновременных записей: профили SQLite с очередью записи и без.
+
+Одновременно запускаются операции записи (add_to_cart, запись события,
+пополнение счета) и чтения (карточка бизнеса, корзина) — как при массовом
+нажатии кнопок. Для каждого профиля в отдельном процессе печатаются
+пропускная способность записи, задержки p50/p99 записи и чтения и ошибки.
+
+    python -m scripts.bench_write_queue [записей] [чтений]
+"""
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from scripts.bench_profiles import percentile, seed
+
+PROFILES = ['sqlite-dev', 'sqlite-prod', 'sqlite-queue']
+PLAYERS = 200
+
+
+async def worker(writes, reads):
+    import app.database.requests as rq
+    from app.database.models import get_engine
+    from app.database.profiles import resolve_profile
+    from app.database.writer import write_queue
+
+    await seed(PLAYERS)
+    _, profile = resolve_profile(os.environ['SQLALCHEMY_URL'], os.environ['DB_PROFILE'])
+    if profile.write_queue:
+        await write_queue.start()
+
+    write_ops = [
+        lambda player: rq.add_to_cart(player + 2, 1, 1),
+        lambda player: rq._insert_event(player + 2, 'bench', 'событие', player + 2),
+        lambda player: rq.add_money_to_company(player + 2, 10),
+    ]
+    read_ops = [
+        lambda player: rq.get_balance_card(player + 2),
+        lambda player: rq.get_cart(player + 2),
+    ]
+    timings = {'write': [], 'read': []}
+    errors = {}
+
+    async def timed(kind, op, player):
+        started = time.perf_counter()
+        try:
+            await op(player % PLAYERS)
+        except Exception as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+        else:
+            timings[kind].append(time.perf_counter() - started)
+
+    calls = [timed('write', write_ops[n % len(write_ops)], n) for n in range(writes)]
+    calls += [timed('read', read_ops[n % len(read_ops)], n) for n in range(reads)]
+    started = time.perf_counter()
+    await asyncio.gather(*calls)
+    elapsed = time.perf_counter() - started
+
+    batches = write_queue.stats()['batches']
+    await write_queue.stop()
+    await get_engine().dispose()
+    return {'elapsed': elapsed, 'timings': timings, 'errors': errors, 'batches': batches}
+
+
+def run_profile(profile, url, writes, reads):
+    env = dict(os.environ, DB_PROFILE=profile, SQLALCHEMY_URL=url)
+    output = subprocess.run(
+        [sys.executable, '-m', 'scripts.bench_write_queue', '--worker', str(writes), str(reads)],
+        env=env, check=True, capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def describe(values):
+    if not values:
+        return f'{"-":>8} {"-":>8}'
+    return f'{statistics.median(values) * 1000:>8.1f} {percentile(values, 0.99) * 1000:>8.1f}'
+
+
+def main():
+    if sys.argv[1:2] == ['--worker']:
+        print(json.dumps(asyncio.run(worker(int(sys.argv[2]), int(sys.argv[3])))))
+        return
+
+    writes = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    reads = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    directory = tempfile.mkdtemp()
+    print(f'{writes} записей и {reads} чтений одновременно, задержки в мс')
+    print(f'{"профиль":<14} {"записей/с":>10} {"зап. p50":>8} {"зап. p99":>8} {"чт. p50":>8} {"чт. p99":>8} '
+          f'{"транз.":>7}  ошибки')
+    for profile in PROFILES:
+        url = f'sqlite+aiosqlite:///{os.path.join(directory, profile + ".db")}'
+        result = run_profile(profile, url, writes, reads)
+        timings = result['timings']
+        throughput = len(timings['write']) / result['elapsed']
+        errors = ', '.join(f'{name}: {count}' for name, count in result['errors'].items()) or '-'
+        transactions = result['batches'] or len(timings['write'])
+        print(f'{profile:<14} {throughput:>10.1f} {describe(timings["write"])} {describe(timings["read"])} '
+              f'{transactions:>7}  {errors}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Проверка планов запросов для горячих функций app.database.requests.
+
+Запускает функции на временной SQLite-базе, перехватывает выполненные ими
+SQL-запросы и прогоняет каждый через EXPLAIN QUERY PLAN. Если какой-то запрос
+читает таблицу полным сканированием, скрипт завершается с кодом 1.
+
+    python -m scripts.check_query_plans
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'plans.db')
+os.environ['SQLALCHEMY_URL'] = f'sqlite+aiosqlite:///{DB_PATH}'
+
+from sqlalchemy import event  # noqa: E402
+
+from app.database.models import async_session, get_engine, Business, Category, Podcategory, Item, User  # noqa: E402
+import app.database.requests as rq  # noqa: E402
+from app.database.migrations import migrate  # noqa: E402
+from app.database.catalog import catalog  # noqa: E402
+
+
+# Функции, которые обработчики вызывают почти на каждое нажатие кнопки
+HOT_CALLS = [
+    ('get_identity', (1001,)),
+    ('get_balance', (1,)),
+    ('get_balance_card', (1,)),
+    ('get_business_contact', (1,)),
+    ('get_businesses_page', ()),
+    ('get_businesses_page', (1,)),
+    ('get_businesses_page', (None, 2)),
+    ('get_item', (1,)),
+    ('get_items_page', (1,)),
+    ('add_to_cart', (1, 1, 2)),
+    ('get_cart', (1,)),
+    ('checkout', (1001,)),
+    ('add_to_cart', (1, 1, 1)),
+    ('clear_cart', (1,)),
+    ('deduct_money_from_business', (1, 1)),
+    ('add_money_to_company', (1, 1)),
+    ('get_processed_callback', ('1:1:confirm_order',)),
+    ('get_fsm_record', ('1:1001:1001',)),
+    ('get_fsm_version', ('1:1001:1001',)),
+]
+
+
+async def seed():
+    await migrate()
+    async with async_session() as session:
+        session.add_all([
+            Business(type='курьер', name='Курьер', budget=1000, income=0, cost=0, expenses=0),
+            Category(name='Категория'),
+        ])
+        await session.flush()
+        session.add_all([
+            User(tg_id=1001, business_id=1),
+            Podcategory(name='Подкатегория', category=1),
+        ])
+        await session.flush()
+        session.add(Item(name='Товар', description='', price=10, weight=1.0, podcategory=1))
+        await session.commit()
+
+
+async def collect_statements():
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+            captured.append((statement, parameters))
+
+    await seed()
+    # Каталог намеренно читается целиком один раз при старте — это не горячий путь
+    await catalog.load()
+    event.listen(get_engine().sync_engine, 'before_cursor_execute', capture)
+    statements = {}
+    for name, args in HOT_CALLS:
+        captured.clear()
+        await getattr(rq, name)(*args)
+        statements.setdefault(name, []).extend(captured)
+    event.remove(get_engine().sync_engine, 'before_cursor_execute', capture)
+    await get_engine().dispose()
+    return statements
+
+
+def full_scans(conn, statement, parameters):
+    plan = [detail for *_, detail in conn.execute(f'EXPLAIN QUERY PLAN {statement}', parameters)]
+    # SCAN (subquery-N) читает уже отфильтрованный промежуточный результат
+    # (например, оконные суммы checkout), а не таблицу
+    scans = [detail for detail in plan if detail.startswith('SCAN ') and not detail.startswith('SCAN (')]
+    # Первая страница keyset-пагинации: без условий, в порядке первичного ключа
+    # без сортировки — чтение останавливается после LIMIT строк
+    first_page = ' WHERE ' not in statement and ' ORDER BY ' in statement and ' LIMIT ' in statement
+    if scans and first_page and not any('TEMP B-TREE' in detail for detail in plan):
+        return []
+    return scans
+
+
+def main():
+    statements = asyncio.run(collect_statements())
+    conn = sqlite3.connect(DB_PATH)
+    failed = False
+    for name, queries in statements.items():
+        ok = True
+        for statement, parameters in queries:
+            scans = full_scans(conn, statement, parameters)
+            if scans:
+                ok = False
+                print(f'FAIL {name}: {", ".join(scans)}\n    {" ".join(statement.split())}')
+        if ok:
+            print(f'ok   {name} ({len(queries)} запр.)')
+        failed = failed or not ok
+    conn.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""Архив журнала событий.
+
+    python -m scripts.events_archive archive --days 90
+    python -m scripts.events_archive read --business 3 --since 2025-01-01 > audit.jsonl
+"""
+import argparse
+import asyncio
+import json
+import sys
+from datetime import datetime
+
+from app.database.retention import archive_events, iter_archived_events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dir', help='каталог архива (по умолчанию EVENT_ARCHIVE_DIR или archive/events)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    archive = commands.add_parser('archive', help='перенести старые события в архив')
+    archive.add_argument('--days', type=int, default=90, help='архивировать события старше N дней')
+
+    read = commands.add_parser('read', help='вывести события из архива в формате JSONL')
+    read.add_argument('--business', type=int, help='ID бизнеса')
+    read.add_argument('--since', type=datetime.fromisoformat, help='с даты (включительно)')
+    read.add_argument('--until', type=datetime.fromisoformat, help='по дату (не включительно)')
+
+    args = parser.parse_args()
+    if args.command == 'archive':
+        archived = asyncio.run(archive_events(args.days, args.dir))
+        print(f'В архив перенесено событий: {archived}', file=sys.stderr)
+        return
+
+    for event in iter_archived_events(args.dir, args.since, args.until, args.business):
+        event['timestamp'] = event['timestamp'].isoformat()
+        sys.stdout.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+
+if __name__ == '__main__':
+    main()